@@ -1,49 +1,71 @@
 # encoding: utf-8
 
 from __future__ import division
-
-
-class CellInfo:
-    def __init__(self, x, y, attacked_by_white):
-        self.x = x
-        self.y = y
-        self.attacked_by_white = attacked_by_white
-
-    def __eq__(self, other):
-        if not isinstance(other, CellInfo):
-            return False
-        return self.x == other.x and self.y == other.y and self.attacked_by_white == other.attacked_by_white
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
+from pieces import CHESS_GRID
 
 
 class SimpleAttackGrid:
-    """Упрощенный объект с полями, которые атакованы фигурами; используется для расчета следующей позиции
+    """Поля, которые атакованы фигурами; не зависит от отрисовки и используется в position.Position
+    white_counts, black_counts - число белых и черных фигур, атакующих каждую клетку,
+        массивы из CHESS_GRID * CHESS_GRID чисел по строкам
+    piece_cells - словарь фигура -> список индексов атакуемых ей клеток (только клетки доски)
     """
     def __init__(self):
-        self.attacked_cells = []
+        self.white_counts = [0] * (CHESS_GRID * CHESS_GRID)
+        self.black_counts = [0] * (CHESS_GRID * CHESS_GRID)
+        self.piece_cells = {}
+
+    def set_piece_cells(self, piece, cells):
+        """Заменяет клетки, атакуемые фигурой, и возвращает прежний список индексов клеток
+        piece - фигура
+        cells - список индексов клеток, либо None если фигура ничего не атакует (снята с доски)
+        """
+        counts = self.white_counts if piece.is_white else self.black_counts
+        old_cells = self.piece_cells.pop(piece, None)
+        if old_cells is not None:
+            for index in old_cells:
+                counts[index] -= 1
+        if cells is not None:
+            for index in cells:
+                counts[index] += 1
+            self.piece_cells[piece] = cells
+        return old_cells
+
+    def is_attacked(self, x, y, by_white):
+        """Возвращает True, если клетка атакована хотя бы одной фигурой заданного цвета
+        x, y - ячейковые коор-ты
+        by_white - True если интересуют белые фигуры
+        """
+        counts = self.white_counts if by_white else self.black_counts
+        return counts[y * CHESS_GRID + x] > 0
+
+    def crosses(self, piece, indices):
+        """Возвращает True, если фигура атакует хотя бы одну из клеток
+        indices - индексы клеток
+        """
+        cells = self.piece_cells.get(piece, ())
+        for index in indices:
+            if index in cells:
+                return True
+        return False
 
-    def add_cells(self, cells, is_white):
-        """Добавляет список коор-т ячеек к атакуемым ячейкам
-        cells - список коор-т ячеек
-        is_white - является ли атакующая фигура белой
+    def reset_cells(self):
+        """Обнуляет атакуемые клетки
         """
-        for x, y in cells:
-            self.attacked_cells.append(CellInfo(x, y, is_white))
+        self.white_counts = [0] * (CHESS_GRID * CHESS_GRID)
+        self.black_counts = [0] * (CHESS_GRID * CHESS_GRID)
+        self.piece_cells = {}
 
 
 class AttackGrid:
-    """Поля, которые атакованы фигурами
+    """Отрисовка полей, которые атакованы фигурами
     pix_x, pix_y - левый верхний угол
     cell_size - Размер клетки в пикселах
-    attacked_cells - список атакуемых ячеек-объектов CellInfo
     """
     def __init__(self, pix_x, pix_y, cell_size):
         self.pix_x = pix_x
         self.pix_y = pix_y
         self.cell_size = cell_size
-        self.attacked_cells = []
 
     def render(self, screen, grid):
         """ Отрисовка атакованных клеток
@@ -52,41 +74,16 @@ class AttackGrid:
         """
         width = self.cell_size // 2
         height = self.cell_size // 2
-        white_attacked = {}
-        black_attacked = {}
         font = screen.get_font('Arial Black', 20)
         white_color = [255, 255, 255]
         black_color = [0, 0, 0]
-        for cell_info in self.attacked_cells:
-            is_white = cell_info.attacked_by_white
-            x = cell_info.x
-            y = cell_info.y
-            if not grid.good_coords(x, y):
-                continue
-            pix_x = x * self.cell_size + self.pix_x
-            pix_y = y * self.cell_size + self.pix_y
-            if is_white:
-                white_attacked[pix_x, pix_y] = white_attacked.get((pix_x, pix_y), 0) + 1
-            else:
-                black_attacked[pix_x, pix_y] = black_attacked.get((pix_x, pix_y), 0) + 1
-
-        for pix_x, pix_y in white_attacked.keys():
-            text = str(white_attacked[pix_x, pix_y])
-            screen.draw_text(text, font, white_color, pix_x, pix_y + height, width, height)
-
-        for pix_x, pix_y in black_attacked.keys():
-            text = str(black_attacked[pix_x, pix_y])
-            screen.draw_text(text, font, black_color, pix_x + width, pix_y, width, height)
-
-    def add_cells(self, cells, is_white):
-        """Добавляет список коор-т ячеек к атакуемым ячейкам
-        cells - список коор-т ячеек
-        is_white - является ли атакующая фигура белой
-        """
-        for x, y in cells:
-            self.attacked_cells.append(CellInfo(x, y, is_white))
-
-    def reset_cells(self):
-        """Обнуляет список атакуемых ячеек
-        """
-        self.attacked_cells = []
+        attack_grid = grid.position.attack_grid
+        for index in range(CHESS_GRID * CHESS_GRID):
+            pix_x = index % CHESS_GRID * self.cell_size + self.pix_x
+            pix_y = index // CHESS_GRID * self.cell_size + self.pix_y
+            white_count = attack_grid.white_counts[index]
+            if white_count:
+                screen.draw_text(str(white_count), font, white_color, pix_x, pix_y + height, width, height)
+            black_count = attack_grid.black_counts[index]
+            if black_count:
+                screen.draw_text(str(black_count), font, black_color, pix_x + width, pix_y, width, height)
@@ -0,0 +1,182 @@
+# encoding: utf-8
+"""Дебютная книга: двоичный файл записей (хеш позиции, ход, вес), отсортированных по хешу.
+Книга строится из партий в PGN, а при игре открывается через mmap и читается двоичным поиском,
+без разбора файла при загрузке; страницы файла общие у всех процессов, открывших книгу.
+
+Запуск:
+    python book.py games.pgn -o data/book.bin   - построить книгу
+    python book.py --probe "FEN" -o data/book.bin - показать ходы книги для позиции
+"""
+
+from __future__ import division, print_function
+import argparse
+import io
+import mmap
+import os
+import random
+import struct
+from history import pack_move, unpack_move
+from pgn import read_games, parse_san, move_to_san
+from pieces import CHESS_GRID
+from position import Position, generate_legal_moves
+
+BOOK_PATH = os.path.join('data', 'book.bin')
+BOOK_MAGIC = b'CHESSBK1'
+# Запись: 64-битный хеш Зобриста, ход в виде history.pack_move, вес; big-endian, чтобы порядок байт
+# совпадал с порядком чисел
+RECORD = struct.Struct('>QHH')
+DEFAULT_BOOK_PLIES = 20
+MAX_WEIGHT = 0xffff
+
+# Вес хода по результату партии для стороны, которая ходила: победа, ничья, поражение
+RESULT_WEIGHTS = {'win': 2, 'draw': 1, 'loss': 0}
+
+
+def result_weight(result, is_white):
+    """Вес хода по результату партии ('1-0', '0-1', '1/2-1/2', '*'); неизвестный результат считается ничьей
+    """
+    if result == '1-0':
+        return RESULT_WEIGHTS['win' if is_white else 'loss']
+    if result == '0-1':
+        return RESULT_WEIGHTS['loss' if is_white else 'win']
+    return RESULT_WEIGHTS['draw']
+
+
+def build_book(games, path, max_plies=DEFAULT_BOOK_PLIES):
+    """Строит книгу из партий и записывает ее в файл. Возвращает пару (число партий, число записей).
+    Партия с неразрешенным ходом учитывается до этого хода
+    games - итератор по pgn.PgnGame
+    path - путь к файлу книги
+    max_plies - сколько первых полуходов каждой партии брать в книгу
+    """
+    weights = {}
+    game_count = 0
+    for game in games:
+        game_count += 1
+        try:
+            position = game.start_position()
+        except ValueError:
+            continue
+        for san in game.moves[:max_plies]:
+            try:
+                piece, x, y, promotion = parse_san(position, san)
+            except ValueError:
+                break
+            record_key = (position.zobrist_key,
+                          pack_move(piece.y * CHESS_GRID + piece.x, y * CHESS_GRID + x, promotion))
+            weights[record_key] = weights.get(record_key, 0) + result_weight(game.result, piece.is_white)
+            position.make_move(piece, x, y, promotion)
+
+    with open(path, 'wb') as out:
+        out.write(BOOK_MAGIC)
+        for (key, move), weight in sorted(weights.items()):
+            # ход, который встречался только в проигранных партиях, все равно остается в книге с малым весом
+            out.write(RECORD.pack(key, move, min(max(weight, 1), MAX_WEIGHT)))
+    return game_count, len(weights)
+
+
+class OpeningBook:
+    """Дебютная книга, открытая через mmap
+    path - путь к файлу книги
+    count - число записей
+    """
+    def __init__(self, path=BOOK_PATH):
+        self.path = path
+        with open(path, 'rb') as book_file:
+            size = os.fstat(book_file.fileno()).st_size
+            if size < len(BOOK_MAGIC) or (size - len(BOOK_MAGIC)) % RECORD.size:
+                raise ValueError('bad opening book file %r' % path)
+            self.data = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(BOOK_MAGIC)] != BOOK_MAGIC:
+            self.data.close()
+            raise ValueError('bad opening book file %r' % path)
+        self.count = (size - len(BOOK_MAGIC)) // RECORD.size
+
+    def get_record(self, number):
+        """Запись с данным номером: (хеш, ход, вес)
+        """
+        return RECORD.unpack_from(self.data, len(BOOK_MAGIC) + number * RECORD.size)
+
+    def find_entries(self, key):
+        """Возвращает список пар (ход в виде history.pack_move, вес) для позиции с данным хешем
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.count:
+            record_key, move, weight = self.get_record(low)
+            if record_key != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    def find_moves(self, position):
+        """Возвращает список пар (ход (фигура, x, y, promotion), вес) для позиции.
+        Ходы проверяются по правилам, поэтому совпадение хешей разных позиций не даст неразрешенного хода
+        :type position: position.Position
+        """
+        entries = self.find_entries(position.zobrist_key)
+        if not entries:
+            return []
+        legal_moves = dict(((move[0].y * CHESS_GRID + move[0].x, move[2] * CHESS_GRID + move[1], move[3]), move)
+                           for move in generate_legal_moves(position))
+        moves = []
+        for packed, weight in entries:
+            from_x, from_y, to_x, to_y, promotion = unpack_move(packed)
+            move = legal_moves.get((from_y * CHESS_GRID + from_x, to_y * CHESS_GRID + to_x, promotion))
+            if move is not None:
+                moves.append((move, weight))
+        return moves
+
+    def choose_move(self, position, rng=random):
+        """Выбирает ход из книги случайно пропорционально весам, либо возвращает None, если позиции нет в книге
+        """
+        moves = self.find_moves(position)
+        total = sum(weight for move, weight in moves)
+        if not total:
+            return None
+        pick = rng.uniform(0, total)
+        for move, weight in moves:
+            pick -= weight
+            if pick <= 0:
+                return move
+        return moves[-1][0]
+
+    def close(self):
+        self.data.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an opening book from PGN files or probe it')
+    parser.add_argument('pgn', nargs='*', help='PGN files to build the book from')
+    parser.add_argument('-o', '--output', default=BOOK_PATH, help='book file')
+    parser.add_argument('-p', '--plies', type=int, default=DEFAULT_BOOK_PLIES, help='plies of each game to use')
+    parser.add_argument('--probe', metavar='FEN', help='list book moves for a position instead of building')
+    args = parser.parse_args()
+
+    if args.probe:
+        book = OpeningBook(args.output)
+        position = Position.from_fen(args.probe)
+        for move, weight in sorted(book.find_moves(position), key=lambda entry: -entry[1]):
+            print('%-8s %d' % (move_to_san(position, move), weight))
+        book.close()
+        return
+
+    def all_games():
+        for path in args.pgn:
+            with io.open(path, encoding='utf-8', errors='replace') as stream:
+                for game in read_games(stream):
+                    yield game
+
+    game_count, record_count = build_book(all_games(), args.output, args.plies)
+    print('%d games, %d book entries written to %s' % (game_count, record_count, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# encoding: utf-8
+"""Картинки досок без окна: позиции из файла FEN рисуются тем же Grid.render, что и в игре,
+на поверхности в памяти и сохраняются в PNG. Каждый процесс-работник один раз загружает текстуру доски,
+шрифты и собирает спрайты фигур, а дальше переиспользует их для всех своих картинок.
+"""
+
+from __future__ import division, print_function
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+# без дисплея pygame рисует в памяти
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+from grid import Grid
+from position import Position
+from screen import Screen
+from workers import chunked, map_chunks
+
+BOARD_SIZE = 720  # размер картинки доски до масштабирования, как в окне игры
+BOARD_OFFSET = 40
+CELL_SIZE = 80
+BG_COLOR = (150, 50, 250)
+DEFAULT_CHUNK_SIZE = 32
+
+
+class DiagramRenderer:
+    """Рисует позиции в PNG; держит одну поверхность, один Screen и один Grid на все картинки,
+    поэтому текстура, шрифты, надписи и спрайты фигур загружаются и собираются один раз
+    size - сторона картинки в пикселах
+    """
+    def __init__(self, size=BOARD_SIZE):
+        pygame.init()
+        self.size = size
+        self.surface = pygame.Surface((BOARD_SIZE, BOARD_SIZE))
+        self.screen = Screen(self.surface)
+        self.grid = Grid(0, 0, BOARD_SIZE, BOARD_OFFSET, BOARD_OFFSET, CELL_SIZE)
+        self.grid.show_cursor = False
+
+    def render(self, position):
+        """Рисует позицию и возвращает поверхность с картинкой
+        :type position: position.Position
+        """
+        self.grid.set_position(position)
+        self.surface.fill(BG_COLOR)
+        self.grid.render(self.screen)
+        # картинка рисуется целиком, области для перерисовки не нужны; без очистки их список растет с каждой картинкой
+        self.grid.take_dirty_rects()
+        if self.size != BOARD_SIZE:
+            return pygame.transform.smoothscale(self.surface, (self.size, self.size))
+        return self.surface
+
+    def save(self, position, path):
+        """Рисует позицию в файл PNG
+        """
+        pygame.image.save(self.render(position), path)
+
+
+_worker_renderer = None
+
+
+def _init_worker(size):
+    global _worker_renderer
+    _worker_renderer = DiagramRenderer(size)
+
+
+def render_chunk(chunk, out_dir):
+    """Задание для процесса-работника: рисует пачку позиций.
+    Возвращает пару (число позиций в пачке, список ошибок (номер строки, текст ошибки) для позиций,
+    которые не удалось прочитать)
+    chunk - список пар (номер строки, FEN)
+    out_dir - папка для картинок; картинка называется по номеру строки
+    """
+    errors = []
+    for number, fen in chunk:
+        try:
+            position = Position.from_fen(fen)
+        except ValueError as error:
+            errors.append((number, str(error)))
+            continue
+        _worker_renderer.save(position, os.path.join(out_dir, '%06d.png' % number))
+    return len(chunk), errors
+
+
+def read_positions(stream):
+    """Читает FEN по строке и отдает пары (номер строки с единицы, FEN).
+    Пустые строки и строки, начинающиеся с '#', пропускаются
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield number, line
+
+
+def render_file(stream, out_dir, workers, size=BOARD_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Рисует все позиции из потока. Возвращает пару (число позиций, список ошибок)
+    workers - число процессов; при 1 все рисуется в текущем процессе
+    """
+    total = 0
+    errors = []
+    for count, chunk_errors in map_chunks(render_chunk, chunked(read_positions(stream), chunk_size), workers,
+                                          (out_dir,), _init_worker, (size,)):
+        total += count
+        errors.extend(chunk_errors)
+    return total, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render board diagrams for positions to PNG files')
+    parser.add_argument('positions', help='file with one FEN per line, - for standard input')
+    parser.add_argument('-o', '--output', default='diagrams', help='output directory')
+    parser.add_argument('-s', '--size', type=int, default=BOARD_SIZE, help='image size in pixels')
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count(), help='number of processes')
+    parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='positions per task')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    stream = sys.stdin if args.positions == '-' else io.open(args.positions, encoding='utf-8')
+
+    start = time.time()
+    total, errors = render_file(stream, args.output, args.workers, args.size, max(args.chunk_size, 1))
+    elapsed = time.time() - start
+    for number, error in errors:
+        print('line %d: %s' % (number, error), file=sys.stderr)
+    print('%d positions, %d images, %.2fs, %.1f images/s' % (
+        total, total - len(errors), elapsed, total / elapsed if elapsed else 0), file=sys.stderr)
+    raise SystemExit(0 if not errors else 1)
+
+
+if __name__ == '__main__':
+    main()
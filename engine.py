@@ -0,0 +1,679 @@
+# encoding: utf-8
+"""Компьютерный соперник: перебор с итеративным углублением, альфа-бета отсечением
+и таблицей транспозиций фиксированного размера.
+Работает на position.Position через make_move/unmake_move и generate_legal_moves, без копирования доски.
+"""
+
+from __future__ import division, print_function
+import argparse
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pieces import CHESS_GRID, King, Queen, Rook, Bishop, Knight, Pawn
+from position import DRAW_FIFTY_MOVES, Position, generate_legal_moves, move_name
+from tablebase import MAX_TABLEBASE_PIECES, Tablebase
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+# Оценки больше этой означают мат за известное число полуходов
+MATE_THRESHOLD = MATE_SCORE - 1000
+
+DEFAULT_MAX_DEPTH = 64
+DEFAULT_TIME_LIMIT = 2.0
+DEFAULT_TABLE_SIZE = 1 << 18
+
+# Как часто (в узлах) проверять, не вышло ли время
+TIME_CHECK_NODES = 1024
+
+PIECE_VALUES = {
+    King: 0,
+    Queen: 900,
+    Rook: 500,
+    Bishop: 330,
+    Knight: 320,
+    Pawn: 100,
+}
+
+# Бонусы за клетки для белых фигур, по строкам доски сверху вниз (y = 0 - сторона черных).
+# Для черных фигур таблица отражается по вертикали
+PIECE_SQUARE_TABLES = {
+    Pawn: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ],
+    Knight: [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ],
+    Bishop: [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ],
+    Rook: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ],
+    Queen: [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ],
+    King: [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ],
+}
+
+# Типы записей таблицы транспозиций
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+
+def evaluate(position):
+    """Оценка позиции в сотых долях пешки с точки зрения стороны, чей сейчас ход
+    :type position: position.Position
+    """
+    score = 0
+    for piece in position.pieces:
+        piece_type = piece.__class__
+        if piece.is_white:
+            score += PIECE_VALUES[piece_type] + PIECE_SQUARE_TABLES[piece_type][piece.y * CHESS_GRID + piece.x]
+        else:
+            score -= PIECE_VALUES[piece_type] + PIECE_SQUARE_TABLES[piece_type][(CHESS_GRID - 1 - piece.y) * CHESS_GRID + piece.x]
+    return score if position.is_whites_turn else -score
+
+
+def move_key(move):
+    """Компактная запись хода для таблицы транспозиций: (клетка откуда, клетка куда, тип превращения)
+    move - ход в виде кортежа (фигура, x, y, promotion)
+    """
+    piece, x, y, promotion = move
+    return piece.y * CHESS_GRID + piece.x, y * CHESS_GRID + x, promotion
+
+
+class TranspositionTable:
+    """Таблица транспозиций фиксированного размера.
+    В каждой ячейке два места: одно заменяется только более глубоким результатом (или результатом
+    другой позиции, если старый уже с прошлых поисков), второе заменяется всегда
+    size - число ячеек
+    deep_entries, recent_entries - записи (хеш, глубина, оценка, тип оценки, ход, номер поиска) либо None
+    generation - номер текущего поиска
+    """
+    def __init__(self, size=DEFAULT_TABLE_SIZE):
+        self.size = size
+        self.deep_entries = [None] * size
+        self.recent_entries = [None] * size
+        self.generation = 0
+
+    def probe(self, key):
+        """Возвращает запись для позиции с данным хешем, либо None
+        """
+        index = key % self.size
+        entry = self.deep_entries[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        entry = self.recent_entries[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, flag, move):
+        """Запоминает результат поиска позиции
+        move - компактная запись лучшего хода (см. move_key), либо None
+        """
+        index = key % self.size
+        entry = (key, depth, score, flag, move, self.generation)
+        old = self.deep_entries[index]
+        if old is None or old[0] == key or depth >= old[1] or old[5] != self.generation:
+            self.deep_entries[index] = entry
+        else:
+            self.recent_entries[index] = entry
+
+
+class SearchTimeout(Exception):
+    """Время на поиск вышло, либо поиск остановлен
+    """
+
+
+class SearchResult:
+    """Результат поиска
+    best_move - лучший ход (фигура, x, y, promotion), либо None если ходов нет
+    score - оценка позиции для стороны, чей ход
+    depth - глубина последней полностью просчитанной итерации
+    nodes - число просмотренных позиций
+    elapsed - затраченное время в секундах
+    """
+    def __init__(self, best_move, score, depth, nodes, elapsed):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+
+class Engine:
+    """Компьютерный игрок
+    max_depth - наибольшая глубина перебора в полуходах
+    time_limit - время на ход в секундах, либо None
+    table - таблица транспозиций, общая для всех поисков этого игрока
+    stop_requested - выставляется из другого потока, чтобы прервать поиск; сбрасывает тот, кто запускает поиск
+        (BackgroundSearch.start), а не сам поиск в начале, иначе остановка до начала поиска терялась бы.
+        По окончании поиска флаг сбрасывается, чтобы не прерывать следующие поиски
+    stop_event - multiprocessing.Event, которым поиск прерывают из другого процесса, либо None
+    tablebase - tablebase.Tablebase для точной оценки окончаний, либо None
+    """
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, time_limit=DEFAULT_TIME_LIMIT, table_size=DEFAULT_TABLE_SIZE,
+                 tablebase=None):
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.table = TranspositionTable(table_size)
+        self.tablebase = tablebase
+        self.nodes = 0
+        self.deadline = None
+        self.stop_requested = False
+        self.stop_event = None
+
+    def search(self, position, max_depth=None, time_limit=None, on_iteration=None):
+        """Ищет лучший ход итеративным углублением. Позиция после поиска остается прежней.
+        Возвращает SearchResult
+        :type position: position.Position
+        max_depth, time_limit - ограничения для этого поиска, по умолчанию берутся из настроек игрока
+        on_iteration - функция, которая зовется с SearchResult после каждой законченной итерации
+        """
+        max_depth = max_depth or self.max_depth
+        time_limit = time_limit if time_limit is not None else self.time_limit
+        start = time.time()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.nodes = 0
+        self.table.generation += 1
+
+        moves = generate_legal_moves(position)
+        if not moves:
+            self.clear_stop()
+            return SearchResult(None, 0, 0, 0, 0)
+        result = SearchResult(moves[0], 0, 0, 0, 0)
+        for depth in range(1, max_depth + 1):
+            try:
+                best_move, score = self.search_root(position, moves, depth)
+            except SearchTimeout:
+                break
+            result = SearchResult(best_move, score, depth, self.nodes, time.time() - start)
+            if on_iteration is not None:
+                on_iteration(result)
+            if abs(score) >= MATE_THRESHOLD:
+                # мат найден, глубже искать незачем
+                break
+            # лучший ход предыдущей итерации смотрим первым
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+        self.clear_stop()
+        result.nodes = self.nodes
+        result.elapsed = time.time() - start
+        return result
+
+    def search_root(self, position, moves, depth):
+        """Одна итерация поиска из корня. Возвращает пару (лучший ход, оценка)
+        """
+        alpha = -INFINITY
+        best_move = moves[0]
+        for move in moves:
+            undo = position.make_move(*move)
+            try:
+                score = -self.alpha_beta(position, depth - 1, -INFINITY, -alpha, 1)
+            finally:
+                position.unmake_move(undo)
+            if score > alpha:
+                alpha = score
+                best_move = move
+        self.table.store(position.zobrist_key, depth, alpha, EXACT, move_key(best_move))
+        return best_move, alpha
+
+    def stop(self):
+        """Просит прервать идущий поиск; можно звать из другого потока
+        """
+        self.stop_requested = True
+
+    def clear_stop(self):
+        """Снимает просьбу прервать поиск
+        """
+        self.stop_requested = False
+
+    def check_time(self):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0:
+            if self.stop_requested or (self.stop_event is not None and self.stop_event.is_set()) or \
+                    (self.deadline is not None and time.time() > self.deadline):
+                raise SearchTimeout()
+
+    def alpha_beta(self, position, depth, alpha, beta, ply):
+        """Перебор с альфа-бета отсечением (negamax). Возвращает оценку для стороны, чей ход
+        ply - расстояние от корня в полуходах, нужно для оценки матов
+        """
+        self.check_time()
+        # повторение внутри поиска - уже ничья: если позиция выгодна, ее можно добиться иначе
+        draw_reason = position.get_draw_reason(2)
+        if draw_reason is not None:
+            # мат на сотом полуходе важнее правила 50 ходов, как в Position.check_game_end;
+            # при повторении и недостатке материала мата быть не может
+            if draw_reason == DRAW_FIFTY_MOVES and not generate_legal_moves(position) and \
+                    position.king_under_attack(position.is_whites_turn):
+                return -MATE_SCORE + ply
+            return 0
+        key = position.zobrist_key
+        entry = self.table.probe(key)
+        table_move = None
+        if entry is not None:
+            table_move = entry[4]
+            if entry[1] >= depth:
+                score = score_from_table(entry[2], ply)
+                flag = entry[3]
+                if flag == EXACT:
+                    return score
+                if flag == LOWER_BOUND and score >= beta:
+                    return score
+                if flag == UPPER_BOUND and score <= alpha:
+                    return score
+
+        if self.tablebase is not None and len(position.pieces) <= MAX_TABLEBASE_PIECES:
+            result = self.tablebase.probe(position)
+            if result is not None:
+                return tablebase_score(result, ply)
+
+        if depth <= 0:
+            return self.quiescence(position, alpha, beta, ply)
+
+        moves = generate_legal_moves(position)
+        if not moves:
+            if position.king_under_attack(position.is_whites_turn):
+                return -MATE_SCORE + ply
+            return 0
+        order_moves(position, moves, table_move)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in moves:
+            undo = position.make_move(*move)
+            try:
+                score = -self.alpha_beta(position, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                position.unmake_move(undo)
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.table.store(key, depth, score_to_table(best_score, ply), flag, move_key(best_move))
+        return best_score
+
+    def quiescence(self, position, alpha, beta, ply):
+        """Досчитывает взятия, чтобы не оценивать позицию посреди размена
+        """
+        self.check_time()
+        stand_pat = evaluate(position)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        board = position.board
+        captures = [move for move in generate_legal_moves(position)
+                    if board[move[2] * CHESS_GRID + move[1]] is not None or move[3] is not None]
+        order_moves(position, captures, None)
+        for move in captures:
+            undo = position.make_move(*move)
+            try:
+                score = -self.quiescence(position, -beta, -alpha, ply + 1)
+            finally:
+                position.unmake_move(undo)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+def order_moves(position, moves, table_move):
+    """Сортирует ходы: сначала ход из таблицы транспозиций, затем взятия (ценная жертва дешевой фигурой),
+    превращения, затем тихие ходы
+    """
+    board = position.board
+
+    def move_order(move):
+        piece, x, y, promotion = move
+        if table_move is not None and move_key(move) == table_move:
+            return -INFINITY
+        order = 0
+        target = board[y * CHESS_GRID + x]
+        if target is not None:
+            order -= 10 * PIECE_VALUES[target.__class__] - PIECE_VALUES[piece.__class__]
+        if promotion is not None:
+            order -= PIECE_VALUES[promotion]
+        return order
+
+    moves.sort(key=move_order)
+
+
+def tablebase_score(result, ply):
+    """Оценка по результату из эндшпильных таблиц: выигрыш и проигрыш - маты с известным числом полуходов
+    result - пара (исход, полуходов до мата) из Tablebase.probe
+    """
+    outcome, plies = result
+    if outcome == 'win':
+        return MATE_SCORE - ply - plies
+    if outcome == 'loss':
+        return -MATE_SCORE + ply + plies
+    return 0
+
+
+def score_to_table(score, ply):
+    """Оценка мата в таблице хранится от текущей позиции, а не от корня
+    """
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+class BackgroundSearch:
+    """Поиск хода в отдельном потоке, чтобы игровой цикл продолжал рисовать кадры.
+    Поиск идет на копии позиции, поэтому игровую позицию можно рисовать, пока компьютер думает
+    engine - Engine или ParallelEngine
+    progress - SearchResult последней законченной итерации, либо None
+    progress_text - текст о последней законченной итерации, либо None; собирается в потоке поиска,
+        пока фигуры копии стоят на своих местах, потому что дальше поиск двигает их по доске
+    result - итоговый SearchResult, когда поиск закончен; None если поиск отменен
+    """
+    def __init__(self, engine, position):
+        """
+        :type position: position.Position
+        """
+        self.engine = engine
+        self.position = Position.from_state(position.to_state())
+        self.progress = None
+        self.progress_text = None
+        self.result = None
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.engine.clear_stop()
+        self.thread.start()
+
+    def run(self):
+        result = self.engine.search(self.position, on_iteration=self.set_progress)
+        if not self.cancelled:
+            self.result = result
+
+    def set_progress(self, result):
+        piece, x, y, promotion = result.best_move
+        self.progress_text = 'Depth %d: %s %+.2f' % (
+            result.depth, move_name(piece.x, piece.y, x, y, promotion), result.score / 100)
+        self.progress = result
+
+    def cancel(self):
+        """Прерывает поиск, результата не будет
+        """
+        self.cancelled = True
+        self.engine.stop()
+
+    def is_done(self):
+        return not self.thread.is_alive()
+
+    def best_move_key(self):
+        """Лучший найденный ход в виде move_key, чтобы найти его в игровой позиции; None если хода нет
+        """
+        if self.result is None or self.result.best_move is None:
+            return None
+        return move_key(self.result.best_move)
+
+    def describe(self):
+        """Текст о ходе поиска для вывода на экран
+        """
+        progress_text = self.progress_text
+        if progress_text is None:
+            return 'Thinking...'
+        return progress_text
+
+
+def find_move(position, key):
+    """Находит разрешенный ход по его компактной записи (см. move_key), либо возвращает None
+    """
+    for move in generate_legal_moves(position):
+        if move_key(move) == key:
+            return move
+    return None
+
+
+# Игрок в процессе-работнике; таблица транспозиций у каждого процесса своя и живет между заданиями
+_worker_engine = None
+
+
+def _init_worker(table_size, tablebase_dir, stop_event):
+    global _worker_engine
+    _worker_engine = Engine(table_size=table_size,
+                            tablebase=Tablebase(tablebase_dir) if tablebase_dir is not None else None)
+    _worker_engine.stop_event = stop_event
+
+
+def _search_root_move(state, key, depth, alpha, deadline):
+    """Задание для процесса-работника: оценивает один ход из корня на заданную глубину.
+    Возвращает пару (оценка хода для стороны, которая его делает, число узлов); оценка None, если время вышло
+    или поиск остановлен.
+    Оценка не больше alpha означает лишь, что ход не лучше уже найденного
+    state - позиция в виде Position.to_state
+    key - ход в виде move_key
+    alpha - оценка лучшего из уже посчитанных ходов
+    deadline - момент time.time(), после которого поиск прерывается, либо None
+    """
+    engine = _worker_engine
+    if engine.stop_event.is_set():
+        # задание успело попасть в очередь процесса до остановки, отменить его уже нельзя
+        return None, 0
+    position = Position.from_state(state)
+    engine.nodes = 0
+    engine.deadline = deadline
+    position.make_move(*find_move(position, key))
+    try:
+        score = -engine.alpha_beta(position, depth - 1, -INFINITY, -alpha, 1)
+    except SearchTimeout:
+        return None, engine.nodes
+    return score, engine.nodes
+
+
+class ParallelEngine:
+    """Компьютерный игрок, который делит ходы из корня между процессами.
+    На каждой итерации углубления сначала считается лучший ход прошлой итерации, а затем остальные ходы
+    из корня параллельно, отдельными заданиями в пуле процессов, с его оценкой в качестве нижней границы.
+    Позиция передается компактным кортежем Position.to_state, а не объектами фигур
+    workers - число процессов
+    max_depth, time_limit - как у Engine
+    tablebase_dir - папка эндшпильных таблиц; каждый процесс открывает их сам, либо None
+    stop_event - общий с процессами флаг остановки: работники проверяют его вместе со временем и бросают
+        задания, которые уже идут
+    """
+    def __init__(self, workers=None, max_depth=DEFAULT_MAX_DEPTH, time_limit=DEFAULT_TIME_LIMIT,
+                 table_size=DEFAULT_TABLE_SIZE, tablebase_dir=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.table_size = table_size
+        self.tablebase_dir = tablebase_dir
+        self.pool = None
+        self.stop_requested = False
+        self.stop_event = multiprocessing.Event()
+
+    def stop(self):
+        """Просит прервать идущий поиск: задания, которые еще не начались, отменяются, а идущие прерываются
+        """
+        self.stop_requested = True
+        self.stop_event.set()
+
+    def clear_stop(self):
+        """Снимает просьбу прервать поиск
+        """
+        self.stop_requested = False
+        self.stop_event.clear()
+
+    def search(self, position, max_depth=None, time_limit=None, on_iteration=None):
+        """Ищет лучший ход итеративным углублением. Возвращает SearchResult
+        :type position: position.Position
+        on_iteration - функция, которая зовется с SearchResult после каждой законченной итерации
+        """
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                            initargs=(self.table_size, self.tablebase_dir, self.stop_event))
+        max_depth = max_depth or self.max_depth
+        time_limit = time_limit if time_limit is not None else self.time_limit
+        start = time.time()
+        deadline = start + time_limit if time_limit is not None else None
+
+        moves = generate_legal_moves(position)
+        if not moves:
+            self.clear_stop()
+            return SearchResult(None, 0, 0, 0, 0)
+        state = position.to_state()
+        order_moves(position, moves, None)
+        keys = [move_key(move) for move in moves]
+        best_key = keys[0]
+        best_score = 0
+        completed_depth = 0
+        nodes = 0
+        for depth in range(1, max_depth + 1):
+            # первая итерация досчитывается всегда, чтобы был хоть какой-то ход
+            iteration_deadline = deadline if depth > 1 else None
+            first_score, first_nodes = self.pool.submit(
+                _search_root_move, state, keys[0], depth, -INFINITY, iteration_deadline).result()
+            nodes += first_nodes
+            if first_score is None:
+                break
+            futures = [self.pool.submit(_search_root_move, state, key, depth, first_score, iteration_deadline)
+                       for key in keys[1:]]
+            scores = [first_score]
+            for future in futures:
+                if self.stop_requested and future.cancel():
+                    scores.append(None)
+                    continue
+                # идущее задание после остановки быстро вернет None, его надо дождаться, чтобы оно
+                # не проверило флаг остановки уже после того, как поиск его сбросит
+                score, move_nodes = future.result()
+                nodes += move_nodes
+                scores.append(score)
+            if None in scores:
+                break
+            best_score, best_key = max(zip(scores, keys), key=lambda item: item[0])
+            completed_depth = depth
+            if on_iteration is not None:
+                on_iteration(SearchResult(find_move(position, best_key), best_score, depth, nodes, time.time() - start))
+            if abs(best_score) >= MATE_THRESHOLD:
+                break
+            # лучший ход этой итерации считается первым на следующей
+            keys.remove(best_key)
+            keys.insert(0, best_key)
+        self.clear_stop()
+        best_move = find_move(position, best_key)
+        return SearchResult(best_move, best_score, completed_depth, nodes, time.time() - start)
+
+    def close(self):
+        """Останавливает процессы-работники
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def benchmark(workers, depth):
+    """Сравнивает время поиска на заданную глубину на одном процессе и на нескольких
+    по тестовым позициям perft и печатает ускорение
+    """
+    from perft import PERFT_POSITIONS, make_position
+
+    def run(engine):
+        total_time = 0
+        total_nodes = 0
+        for name in sorted(PERFT_POSITIONS):
+            result = engine.search(make_position(name), max_depth=depth, time_limit=None)
+            total_time += result.elapsed
+            total_nodes += result.nodes
+        return total_time, total_nodes
+
+    timings = []
+    for worker_count in sorted(set([1, workers])):
+        engine = ParallelEngine(worker_count)
+        # первый поиск поднимает процессы, его время не учитываем
+        engine.search(make_position('start'), max_depth=1, time_limit=None)
+        elapsed, nodes = run(engine)
+        engine.close()
+        timings.append(elapsed)
+        print('%2d worker(s): %7.2fs %9d nodes %8.0f nodes/s speedup %.2fx' % (
+            worker_count, elapsed, nodes, nodes / elapsed, timings[0] / elapsed))
+    elapsed, nodes = run(Engine())
+    print('single-process Engine: %7.2fs %9d nodes %8.0f nodes/s' % (elapsed, nodes, nodes / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel search speedup benchmark')
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count(), help='number of processes')
+    parser.add_argument('-d', '--depth', type=int, default=4, help='search depth in plies')
+    args = parser.parse_args()
+    benchmark(args.workers, args.depth)
+
+
+if __name__ == '__main__':
+    main()
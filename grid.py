@@ -3,68 +3,31 @@
 from __future__ import division
 import os.path
 import pygame
-from attack import AttackGrid, SimpleAttackGrid
-from pieces import King, Queen, Rook, Bishop, Knight, Pawn
-from history import GameHistory
+from attack import AttackGrid
+from position import Position, generate_legal_moves
 
 HOVER_COLOR = [255, 255, 255]
-CHESS_GRID = 8
-
-
-class SimpleGrid:
-    """Упрощенное игровое поле, которое используется для расчета следующей позиции
-    """
-    def __init__(self, actual_grid, active_piece):
-        """
-        :type actual_grid: Grid
-        """
-        self.pieces = [piece.clone() for piece in actual_grid.pieces]
-        self.active_piece = self.get_piece(active_piece.x, active_piece.y)
-        self.attack_grid = SimpleAttackGrid()
-
-    def get_piece(self, x, y):
-        """Принимает ячейковые коор-ты. Возвращает фигуру, которая находися в этой коор-те, либо None если фигуры нет
-        x, y - ячейковые коор-ты
-        """
-        for piece in self.pieces:
-            if x == piece.x and y == piece.y:
-                return piece
-        return None
-
-    def place_active_piece_at(self, x, y):
-        """Ставит фигуру в ячейку и завершает ход
-        x, y - ячейковые коор-ты
-        """
-        if isinstance(self.active_piece, King) and abs(self.active_piece.x - x) == 2:
-            # рокировка, надо двигать ладью
-            if self.active_piece.x > x:
-                # длинная рокировка
-                rook = self.get_piece(0, self.active_piece.y)
-                rook.x = x + 1
-            else:
-                # короткая рокировка
-                rook = self.get_piece(7, self.active_piece.y)
-                rook.x = x - 1
-        self.active_piece.x = x
-        self.active_piece.y = y
-        self.refresh_attack_cells()
-
-    def refresh_attack_cells(self):
-        """Обновляет атакуемые клетки
-        """
-        for piece in self.pieces:
-            self.attack_grid.add_cells(piece.get_attacked_cells(self), piece.is_white)
+LEGAL_MOVE_COLOR = [32, 160, 64, 128]
 
 
 class Grid:
-    """Игровое поле,
+    """Игровое поле, отвечает за отрисовку и ввод; правила игры живут в position.Position
     bg_x, bg_y - Координаты левого верхнего угла фона игрового поля
     bg_size - Размер фона игрового поля в пикселах
     offset_x, offset_y - Координаты левого верхнего угла игрового поля на экране в пикселах относительно фона
     cell_size - Размер клетки в пикселах
     active_cell - Коор-ты активной ячейки т.е. коор-ты ячейки где находится курсор мыши
+    show_cursor - рисовать ли рамку активной ячейки и клетки, атакованные фигурой под курсором
+    position - Позиция на доске
+    active_moves - клетки, куда может пойти взятая фигура
+    dirty_rects - области экрана, которые изменились с последней отрисовки и должны быть перерисованы
+    drawn_state - состояние позиции при последней отрисовке, чтобы заметить ход, сделанный не мышью
+    tablebase - tablebase.Tablebase для подсказки над доской в окончаниях, либо None
     """
-    def __init__(self, bg_x, bg_y, bg_size, offset_x, offset_y, cell_size):
+    def __init__(self, bg_x, bg_y, bg_size, offset_x, offset_y, cell_size, fen=None):
+        """
+        fen - начальная позиция в нотации FEN; по умолчанию обычная начальная расстановка
+        """
         self.bg_x = bg_x
         self.bg_y = bg_y
         self.bg_size = bg_size
@@ -72,38 +35,19 @@ class Grid:
         self.offset_y = offset_y
         self.cell_size = cell_size
         self.active_cell = (0, 0)
-        self.pieces = []
+        self.show_cursor = True
+        self.position = Position.from_fen(fen) if fen is not None else Position()
         self.active_piece = None
+        self.active_moves = []
         self.mouse_pos = (0, 0)
         self.active_shift = (0, 0)
-        self.is_whites_turn = True
         self.attack_grid = AttackGrid(offset_x + bg_x, offset_y + bg_y, cell_size)
-        self.game_history = GameHistory()
-        self.is_checkmate = False
-        self.is_stalemate = False
-
-        # Расставляем фигуры на доске
-        for x in range(CHESS_GRID):
-            self.place_mirrored(Pawn, x, 1)
-        self.place_mirrored(King, 4, 0)
-        self.place_mirrored(Queen, 3, 0)
-        for x, kind in enumerate([Rook, Knight, Bishop]):
-            self.place_mirrored(kind, x, 0)
-            self.place_mirrored(kind, CHESS_GRID - 1 - x, 0)
-
-        self.refresh_attack_cells()
+        self.dirty_rects = [self.get_rect()]
+        self.drawn_state = None
+        self.tablebase = None
 
         self.bg_texture = pygame.image.load(os.path.join('data', 'chessboard.png'))
 
-    def place_mirrored(self, piece_type, black_x, black_y):
-        """Ставит черную фигуру в заданную ячейку, и зеркально ей ставит такую же белую фигуру.
-        Используется для расстановки фигур в начальной позиции.
-        piece_type - Тип фигуры (Ферзь, король и т.д)
-        black_x, black_y - Координаты ячейки для черной фигуры
-        """
-        self.pieces.append(piece_type(black_x, black_y, False))
-        self.pieces.append(piece_type(black_x, CHESS_GRID - 1 - black_y, True))
-
     def render(self, screen):
         """ Отрисовка игрового поля
         :type screen: screen.Screen
@@ -111,16 +55,30 @@ class Grid:
         # Рисуем фон
         screen.draw_texture(self.bg_texture, self.bg_x, self.bg_y, self.bg_size, self.bg_size)
 
+        self.render_highlights(screen)
+
+        # Рисуем атакованные поля
+        self.attack_grid.render(screen, self)
+
+        self.render_status(screen)
+        self.render_pieces(screen)
+
+    def render_highlights(self, screen):
+        """ Отрисовка подсвеченных клеток: атакованных фигурой под курсором и доступных взятой фигуре
+        :type screen: screen.Screen
+        """
         # Рисуем клетки, атакованные фигурой под курсором мыши
         # TODO: рисовать для фигуры под курсором линии, по которым она атакована?
         attacked_color = [160, 64, 32, 192]
         if self.active_piece is not None:
             piece = self.active_piece
-        else:
+        elif self.show_cursor:
             x, y = self.active_cell
             piece = self.get_piece(x, y)
+        else:
+            piece = None
         if piece is not None:
-            attacked_cells = piece.get_attacked_cells(self)
+            attacked_cells = piece.get_attacked_cells(self.position)
             for x, y in attacked_cells:
                 if not self.good_coords(x, y):
                     continue
@@ -128,38 +86,62 @@ class Grid:
                 pix_y = y * self.cell_size + self.offset_y + self.bg_y
                 screen.draw_rect(attacked_color, pix_x, pix_y, self.cell_size, self.cell_size)
 
-        # Рисуем атакованные поля
-        self.attack_grid.render(screen, self)
+        # Рисуем клетки, куда может пойти взятая фигура
+        for x, y in self.active_moves:
+            pix_x = x * self.cell_size + self.offset_x + self.bg_x
+            pix_y = y * self.cell_size + self.offset_y + self.bg_y
+            screen.draw_rect(LEGAL_MOVE_COLOR, pix_x, pix_y, self.cell_size, self.cell_size)
 
+    def render_status(self, screen):
+        """ Отрисовка надписей над доской: чей ход (или результат окончания по таблицам) и состояние королей
+        :type screen: screen.Screen
+        """
         # Рисуем чей ход
-        if self.is_whites_turn:
+        position = self.position
+        if position.is_whites_turn:
             text = "White's turn"
             color = [255, 255, 255]
         else:
             text = "Black's turn"
             color = [0, 0, 0]
-        if self.is_checkmate:
+        if position.is_checkmate:
             text = 'Checkmate'
-        elif self.is_stalemate:
+        elif position.is_stalemate:
             text = 'Stalemate'
+        elif position.is_draw:
+            text = 'Draw'
+        elif self.tablebase is not None:
+            result = self.tablebase.probe(position)
+            if result is not None:
+                outcome, plies = result
+                if outcome == 'win':
+                    text = 'Mate in %d' % ((plies + 1) // 2)
+                elif outcome == 'loss':
+                    text = 'Mated in %d' % (plies // 2)
+                else:
+                    text = 'Drawn ending'
         font = screen.get_font('Arial Black', 20)
         screen.draw_text(text, font, color, self.bg_x, self.bg_y, self.bg_size, self.offset_y)
 
         # Рисуем состояние королей
-        if self.king_under_attack(self.pieces, self.attack_grid, True):
+        if position.king_under_attack(True):
             white_king_state = 'White king under attack'
         else:
             white_king_state = 'White king is OK'
         screen.draw_text(white_king_state, font, [255, 255, 255], self.bg_x, self.bg_y, 2 * self.bg_size // 5, self.offset_y)
 
-        if self.king_under_attack(self.pieces, self.attack_grid, False):
+        if position.king_under_attack(False):
             black_king_state = 'Black king under attack'
         else:
             black_king_state = 'Black king is OK'
         screen.draw_text(black_king_state, font, [0, 0, 0], self.bg_x + 3 * self.bg_size // 5, self.bg_y, 2 * self.bg_size // 5, self.offset_y)
 
+    def render_pieces(self, screen):
+        """ Отрисовка фигур, рамки активной ячейки и перетаскиваемой фигуры
+        :type screen: screen.Screen
+        """
         # Рисуем фигуры на доске
-        for piece in self.pieces:
+        for piece in self.position.pieces:
             pix_x = self.offset_x + self.bg_x + piece.x * self.cell_size
             pix_y = self.offset_y + self.bg_y + piece.y * self.cell_size
             if piece == self.active_piece:
@@ -167,10 +149,11 @@ class Grid:
             piece.render_at(screen, pix_x, pix_y, self.cell_size)
 
         # Рисуем рамку поверх активной ячейки
-        x, y = self.active_cell
-        bg_x = x * self.cell_size + self.offset_x + self.bg_x
-        bg_y = y * self.cell_size + self.offset_y + self.bg_y
-        screen.draw_frame(HOVER_COLOR, bg_x, bg_y, self.cell_size, self.cell_size, 2)
+        if self.show_cursor:
+            x, y = self.active_cell
+            bg_x = x * self.cell_size + self.offset_x + self.bg_x
+            bg_y = y * self.cell_size + self.offset_y + self.bg_y
+            screen.draw_frame(HOVER_COLOR, bg_x, bg_y, self.cell_size, self.cell_size, 2)
 
         # Рисуем активную фигуру
         if self.active_piece:
@@ -180,14 +163,74 @@ class Grid:
             pix_y = self.offset_y + self.bg_y + mouse_y + shift_y
             self.active_piece.render_at(screen, pix_x, pix_y, self.cell_size)
 
+    def set_position(self, position):
+        """Показывает на поле другую позицию; взятая фигура возвращается на место
+        :type position: position.Position
+        """
+        self.position = position
+        self.active_piece = None
+        self.active_moves = []
+        self.mark_dirty()
+
+    def get_rect(self):
+        """Область экрана, занятая игровым полем вместе с надписями над доской
+        """
+        return pygame.Rect(self.bg_x, self.bg_y, self.bg_size, self.bg_size)
+
+    def get_cell_rect(self, x, y):
+        """Область экрана, занятая ячейкой
+        x, y - ячейковые коор-ты
+        """
+        return pygame.Rect(x * self.cell_size + self.offset_x + self.bg_x, y * self.cell_size + self.offset_y + self.bg_y,
+                           self.cell_size, self.cell_size)
+
+    def get_active_piece_rect(self):
+        """Область экрана, занятая перетаскиваемой фигурой
+        """
+        mouse_x, mouse_y = self.mouse_pos
+        shift_x, shift_y = self.active_shift
+        return pygame.Rect(self.offset_x + self.bg_x + mouse_x + shift_x, self.offset_y + self.bg_y + mouse_y + shift_y,
+                           self.cell_size, self.cell_size)
+
+    def mark_dirty(self, rect=None):
+        """Отмечает область экрана для перерисовки
+        rect - область, по умолчанию все игровое поле
+        """
+        self.dirty_rects.append(rect if rect is not None else self.get_rect())
+
+    def take_dirty_rects(self):
+        """Возвращает области, которые нужно перерисовать, и очищает их список.
+        Если позиция изменилась не через мышь (например, сходил компьютер), перерисовывается все поле
+        """
+        position = self.position
+        state = (len(position.game_history), position.is_checkmate, position.is_stalemate, position.is_draw)
+        if state != self.drawn_state:
+            self.drawn_state = state
+            self.mark_dirty()
+        dirty_rects = self.dirty_rects
+        self.dirty_rects = []
+        return dirty_rects
+
     def mouse_moved(self, pos):
         """Вызывается при движении мыши
         pos - координаты, список из двух чисел
         """
+        if self.active_piece:
+            # фигура стирается со старого места и рисуется на новом
+            self.mark_dirty(self.get_active_piece_rect())
         self.mouse_pos = pos
+        if self.active_piece:
+            self.mark_dirty(self.get_active_piece_rect())
         x, y = self.pixels_to_grid(pos)
-        if not self.good_coords(x, y):
+        if not self.good_coords(x, y) or (x, y) == self.active_cell:
             return
+        old_x, old_y = self.active_cell
+        if self.active_piece is None and (self.get_piece(old_x, old_y) or self.get_piece(x, y)):
+            # меняется фигура под курсором, а с ней и подсвеченные атакованные клетки
+            self.mark_dirty()
+        else:
+            self.mark_dirty(self.get_cell_rect(old_x, old_y))
+            self.mark_dirty(self.get_cell_rect(x, y))
         self.active_cell = (x, y)
 
     def convert_to_local(self, pos):
@@ -210,7 +253,7 @@ class Grid:
     def good_coords(x, y):
         """Возвращает True, если коор-ты х, у принадлежат ячейкам
         """
-        return 0 <= x < CHESS_GRID and 0 <= y < CHESS_GRID
+        return Position.good_coords(x, y)
 
     def mouse_press(self, pos):
         """Вызывается при нажатии левой кнопки мыши
@@ -219,112 +262,28 @@ class Grid:
         pos_x, pos_y = pos
         x, y = self.pixels_to_grid(pos)
         mouse_piece = self.get_piece(x, y)
+        self.mark_dirty()
         if not self.active_piece:
             # берем фигуру
-            if mouse_piece and mouse_piece.is_white == self.is_whites_turn:
+            if mouse_piece and mouse_piece.is_white == self.position.is_whites_turn:
                 self.active_piece = mouse_piece
                 self.active_shift = [x * self.cell_size - pos_x, y * self.cell_size - pos_y]
+                self.active_moves = set((move_x, move_y) for piece, move_x, move_y, _ in generate_legal_moves(self.position)
+                                        if piece is mouse_piece)
         else:
             # ставим фигуру
             if mouse_piece == self.active_piece:
                 # оставляем фигуру на своем месте
                 self.active_piece = None
+                self.active_moves = []
             elif self.good_coords(x, y):
                 # нажатие было внутри игрового поля
-
-                # создаем фейковый грид чтобы проверить разрешенность хода
-                grid_copy = SimpleGrid(self, self.active_piece)
-
-                if mouse_piece and mouse_piece.is_white != self.active_piece.is_white and self.active_piece.can_attack(x, y, self):
-                    # двигаем в клетку, занятую фигурой
-                    grid_copy.pieces.remove(grid_copy.get_piece(x, y))
-                    grid_copy.place_active_piece_at(x, y)
-                elif not mouse_piece and self.active_piece.can_move(x, y, self):
-                    # двигаем в пустую клетку
-                    grid_copy.place_active_piece_at(x, y)
-                else:
-                    # эта фигура не может так пойти
-                    return
-
-                # если ход не открывает короля под шах
-                if not self.king_under_attack(grid_copy.pieces, grid_copy.attack_grid, self.is_whites_turn):
-                    # совершаем ход
-                    self.pieces = grid_copy.pieces
-                    self.attack_grid.attacked_cells = grid_copy.attack_grid.attacked_cells
-                    self.game_history.add_move(self.active_piece, x, y)
+                if self.position.move_piece(self.active_piece, x, y):
                     self.active_piece = None
-                    self.is_whites_turn = not self.is_whites_turn
-                    self.check_game_end()
-                    # TODO сделать превращение пешки при достижении последней горизонтали
-
-    def check_game_end(self):
-        if self.is_stalemate or self.is_checkmate:
-            return
-        if not self.can_move_any_piece(self.is_whites_turn):
-            # никакой ход невозможен
-            if self.king_under_attack(self.pieces, self.attack_grid, self.is_whites_turn):
-                # король под шахом - мат
-                self.is_checkmate = True
-            else:
-                # король не под шахом - пат
-                self.is_stalemate = True
-        # TODO сделать ничью из-за недостатка фигур (два короля и один слон/конь)
-
-    def can_move_any_piece(self, is_white):
-        for piece in self.pieces:
-            if piece.is_white == is_white:
-                cells_to_move_or_attack = piece.get_cells_to_move(self) + piece.get_attacked_cells(self)
-                for x, y in cells_to_move_or_attack:
-                    if self.good_coords(x, y):
-                        # нажатие было внутри игрового поля
-
-                        # создаем фейковый грид чтобы проверить разрешенность хода
-                        grid_copy = SimpleGrid(self, piece)
-
-                        mouse_piece = self.get_piece(x, y)
-                        if mouse_piece and mouse_piece.is_white != piece.is_white and piece.can_attack(x, y, self):
-                            # двигаем в клетку, занятую фигурой
-                            grid_copy.pieces.remove(grid_copy.get_piece(x, y))
-                            grid_copy.place_active_piece_at(x, y)
-                        elif not mouse_piece and piece.can_move(x, y, self):
-                            # двигаем в пустую клетку
-                            grid_copy.place_active_piece_at(x, y)
-                        else:
-                            # эта фигура не может так пойти
-                            continue
-
-                        # если ход не открывает короля под шах
-                        if not self.king_under_attack(grid_copy.pieces, grid_copy.attack_grid, self.is_whites_turn):
-                            return True
-        return False
+                    self.active_moves = []
 
     def get_piece(self, x, y):
         """Принимает ячейковые коор-ты. Возвращает фигуру, которая находися в этой коор-те, либо None если фигуры нет
         x, y - ячейковые коор-ты
         """
-        for piece in self.pieces:
-            if x == piece.x and y == piece.y:
-                return piece
-
-    def refresh_attack_cells(self):
-        """Обновляет атакуемые клетки
-        """
-        self.attack_grid.reset_cells()
-        for piece in self.pieces:
-            self.attack_grid.add_cells(piece.get_attacked_cells(self), piece.is_white)
-
-    @staticmethod
-    def king_under_attack(pieces, attack_grid, is_white_king):
-        """Возвращает True если король белого или черного цвета атакован
-        is_white_king - рассматриваем белого или черного короля
-        """
-        king_figure = None
-        for piece in pieces:
-            if piece.is_white == is_white_king and isinstance(piece, King):
-                king_figure = piece
-        if king_figure is None:
-            return True
-        for cell_info in attack_grid.attacked_cells:
-            if king_figure.x == cell_info.x and king_figure.y == cell_info.y and king_figure.is_white != cell_info.attacked_by_white:
-                return True
-        return False
+        return self.position.get_piece(x, y)
@@ -11,6 +11,7 @@ class Button:
     text - текст
     click - функция, которая зовётся при клике на кнопку
     font - шрифт
+    dirty - True если кнопка изменилась с последней отрисовки
     """
     def __init__(self, x, y, width, height, text, click_function):
         self.x = x
@@ -20,8 +21,10 @@ class Button:
         self.text = text
         self.click = click_function
         self.color = (0, 0, 255)
+        self.dirty = True
 
     def render(self, screen):
+        self.dirty = False
         screen.draw_rect(self.color, self.x, self.y, self.width, self.height)
         font = screen.get_font('Arial', 30)
         screen.draw_text(self.text, font, (255, 170, 170), self.x, self.y, self.width, self.height)
@@ -32,8 +35,16 @@ class Button:
         x, y = pos
         return self.x <= x <= self.x + self.width and self.y <= y <= self.y + self.height
 
+    def get_rect(self):
+        """Область экрана, занятая кнопкой
+        """
+        return pygame.Rect(self.x, self.y, self.width, self.height)
+
     def on_mouse_move(self, pos):
         if self.is_inside(pos):
-            self.color = [128, 128, 255]
+            color = (128, 128, 255)
         else:
-            self.color = (0, 0, 255)
+            color = (0, 0, 255)
+        if color != self.color:
+            self.color = color
+            self.dirty = True
@@ -1,36 +1,61 @@
 # encoding: utf-8
 
 from __future__ import division
+from array import array
+from pieces import CHESS_GRID, Queen, Rook, Bishop, Knight
 
+# Коды фигур превращения в упакованном ходе; 0 - без превращения
+PROMOTION_CODES = {
+    Queen: 1,
+    Rook: 2,
+    Bishop: 3,
+    Knight: 4,
+}
+PROMOTION_TYPES = dict((code, piece_type) for piece_type, code in PROMOTION_CODES.items())
 
-class PieceMove:
-    def __init__(self, piece_id, to_x, to_y):
-        self.piece_id = piece_id
-        self.to_x = to_x
-        self.to_y = to_y
+
+def pack_move(from_index, to_index, promotion=None):
+    """Упаковывает ход в целое число: 6 бит клетки откуда, 6 бит клетки куда и 3 бита кода превращения
+    from_index, to_index - индексы клеток y * CHESS_GRID + x
+    promotion - тип фигуры превращения, либо None
+    """
+    code = PROMOTION_CODES[promotion] if promotion is not None else 0
+    return from_index | to_index << 6 | code << 12
+
+
+def unpack_move(packed):
+    """Распаковывает ход, возвращает (from_x, from_y, to_x, to_y, тип фигуры превращения или None)
+    """
+    from_index = packed & 63
+    to_index = packed >> 6 & 63
+    promotion = PROMOTION_TYPES.get(packed >> 12)
+    return from_index % CHESS_GRID, from_index // CHESS_GRID, to_index % CHESS_GRID, to_index // CHESS_GRID, promotion
 
 
 class GameHistory:
     """
     История ходов
+    moves - ходы по порядку, упакованные pack_move в массив беззнаковых целых
     """
     def __init__(self):
-        self.white_moves = []
-        self.black_moves = []
+        self.moves = array('I')
 
-    def add_move(self, piece, x, y):
+    def add_move(self, from_index, to_index, promotion=None):
+        """Добавляет ход в конец истории
+        from_index, to_index - индексы клеток y * CHESS_GRID + x
+        promotion - тип фигуры превращения, либо None
         """
-        :type piece: pieces.ChessPieceBase
+        self.moves.append(pack_move(from_index, to_index, promotion))
+
+    def pop_move(self):
+        """Удаляет из истории последний ход
         """
-        moves_list = self.white_moves if piece.is_white else self.black_moves
-        moves_list.append(PieceMove(piece.id, x, y))
+        self.moves.pop()
+
+    def __len__(self):
+        return len(self.moves)
 
-    def is_piece_moved(self, piece):
-        """ Получает на вход фигуру вовзращает True если фигура есть в истории ходов, иначе False
-        :type piece: pieces.ChessPieceBase
+    def get_move(self, number):
+        """Возвращает ход с данным номером (с нуля) в виде (from_x, from_y, to_x, to_y, тип превращения или None)
         """
-        moves_list = self.white_moves if piece.is_white else self.black_moves
-        for move in moves_list:
-            if piece.id == move.piece_id:
-                return True
-        return False
+        return unpack_move(self.moves[number])
@@ -1,15 +1,61 @@
 # encoding: utf-8
 from __future__ import division
 
+import argparse
+import atexit
+import os.path
 import pygame
 import sys
+from attack import AttackGrid, SimpleAttackGrid
+from book import BOOK_PATH, OpeningBook
+from engine import Engine, BackgroundSearch, find_move
 from grid import Grid
 from gui import Button
+from pieces import ChessPieceBase
+from position import Position
+from profiler import Profiler
 from screen import Screen
+from tablebase import TABLEBASE_DIR, Tablebase
 
 
 WINDOW_SIZE = (740, 780)  # размер окна в пикселах
 WINDOW_BG_COLOR = (150, 50, 250)  # цвет окна
+COMPUTER_TIME_LIMIT = 2.0  # время на ход компьютера в секундах
+THINKING_TEXT_COLOR = (255, 255, 255)  # цвет текста о ходе поиска компьютера
+THINKING_TEXT_RECT = (545, 5, 185, 40)  # где рисуется текст о ходе поиска компьютера
+DEFAULT_FPS = 60  # наибольшая частота кадров
+PROFILER_OVERLAY_POS = (10, 50)  # где рисуется сводка замеров
+
+parser = argparse.ArgumentParser(description='Chess')
+parser.add_argument('--fps', type=int, default=DEFAULT_FPS, help='frame rate limit')
+parser.add_argument('--loop', choices=['wait', 'poll'], default='wait',
+                    help='wait: sleep until input arrives while the board is idle; poll: check input every frame')
+parser.add_argument('--idle-timeout', type=int, default=0,
+                    help='in wait mode, wake up at least this often (ms) on an idle board; 0 waits for input')
+parser.add_argument('--book', default=BOOK_PATH, help='opening book for the computer, used if the file exists')
+parser.add_argument('--tablebases', default=TABLEBASE_DIR,
+                    help='endgame tablebase directory for the computer and the hint above the board, used if it exists')
+parser.add_argument('--profile', action='store_true', help='show frame timings and hot call counts on screen')
+parser.add_argument('--profile-csv', metavar='FILE', help='write the timing summary to a CSV file on exit')
+args = parser.parse_args()
+
+# дебютная книга компьютера; None если книги нет
+book = OpeningBook(args.book) if os.path.exists(args.book) else None
+# эндшпильные таблицы; None если папки нет
+tablebase = Tablebase(args.tablebases) if os.path.isdir(args.tablebases) else None
+
+# замер времени фаз кадра и счетчики вызовов горячих функций; None если замер выключен
+profiler = Profiler() if args.profile or args.profile_csv else None
+if profiler is not None:
+    for owner, attribute in [(Grid, 'render_highlights'), (AttackGrid, 'render'), (Grid, 'render_status'),
+                             (Grid, 'render_pieces'), (Grid, 'mouse_press'), (Position, 'move_piece'),
+                             (Position, 'check_game_end')]:
+        profiler.time_method(owner, attribute)
+    for owner, attribute in [(Position, 'get_piece'), (ChessPieceBase, 'trace_directions'),
+                             (SimpleAttackGrid, '__init__')]:
+        profiler.count_method(owner, attribute)
+    if args.profile_csv:
+        atexit.register(profiler.export_csv, args.profile_csv)
 
 # инициализация
 pygame.init()
@@ -18,33 +64,108 @@ window_surface = pygame.display.set_mode(WINDOW_SIZE)
 screen = Screen(window_surface)
 
 
+search = None  # поиск хода компьютера в фоновом потоке, engine.BackgroundSearch
+
+# области окна, которые нужно перерисовать; изначально все окно
+dirty_rects = [window_surface.get_rect()]
+drawn_buttons = []  # кнопки, нарисованные в последний раз
+drawn_thinking_text = None  # текст о ходе поиска, нарисованный в последний раз
+
+
 def create_grid():
-    global grid
-    grid = Grid(10, 50, 720, 40, 40, 80)
+    global grid, computer
+    stop_search()
+    grid = Grid(10, 50, 720, 40, 40, 80)  # новое поле само помечает себя для перерисовки
+    grid.tablebase = tablebase
+    computer = None  # компьютерный соперник, играет черными; None в игре двух людей
+
+
+def create_computer_game():
+    global computer
+    create_grid()
+    computer = Engine(time_limit=COMPUTER_TIME_LIMIT, tablebase=tablebase)
+
+
+def stop_search():
+    global search
+    if search is not None:
+        search.cancel()
+        search = None
+
+
+def cancel_thinking():
+    """Отменяет поиск хода компьютера; дальше за черных ходит человек
+    """
+    global computer
+    stop_search()
+    computer = None
 
 create_grid()
 
 new_game_button = Button(10, 5, 200, 40, 'New game', create_grid)
 exit_button = Button(220, 5, 200, 40, 'Exit!', sys.exit)
+computer_game_button = Button(430, 5, 300, 40, 'New game vs computer', create_computer_game)
+cancel_button = Button(430, 5, 110, 40, 'Cancel', cancel_thinking)
+
 
-buttons = [new_game_button, exit_button]
+def get_buttons():
+    """Кнопки, которые сейчас на экране; пока компьютер думает, вместо новой игры с ним показывается отмена
+    """
+    if search is not None:
+        return [new_game_button, exit_button, cancel_button]
+    return [new_game_button, exit_button, computer_game_button]
+
+
+def is_computers_turn():
+    """Возвращает True, если сейчас должен ходить компьютер
+    """
+    position = grid.position
+    if computer is None or position.is_whites_turn:
+        return False
+    return not (position.is_checkmate or position.is_stalemate or position.is_draw)
 
 
 def get_button(pos):
-    for button in buttons:
+    for button in get_buttons():
         if button.is_inside(pos):
             return button
 
 
-def handle_input():
+def is_busy():
+    """Возвращает True, если игра меняется сама, без ввода: компьютер думает или должен начать думать
+    """
+    return search is not None or is_computers_turn()
+
+
+def wait_for_events():
+    """Возвращает накопившиеся события. В режиме wait, пока игра стоит, спит до прихода события
+    (или до --idle-timeout), а пока компьютер думает - не дольше одного кадра
+    """
+    if args.loop == 'poll':
+        return pygame.event.get()
+    if is_busy():
+        # pygame.event.wait(0) ждет без срока, поэтому при частоте кадров выше 1000 ждем хотя бы 1 мс
+        event = pygame.event.wait(max(1000 // max(args.fps, 1), 1))
+    elif args.idle_timeout > 0:
+        event = pygame.event.wait(args.idle_timeout)
+    else:
+        event = pygame.event.wait()
+    events = [event] if event.type != pygame.NOEVENT else []
+    return events + pygame.event.get()
+
+
+def handle_input(events):
     """Обработка input от игрока
+    events - список событий pygame
     """
-    events = pygame.event.get()
     for event in events:
         if event.type == pygame.QUIT:
             sys.exit()
+        elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            # окно было перекрыто, его содержимое нужно нарисовать заново
+            dirty_rects.append(window_surface.get_rect())
         elif event.type == pygame.MOUSEMOTION:
-            for button in buttons:
+            for button in get_buttons():
                 button.on_mouse_move(event.pos)
             pos = grid.convert_to_local(event.pos)
             grid.mouse_moved(pos,)
@@ -54,28 +175,98 @@ def handle_input():
                 button.click()
             else:
                 pos = grid.convert_to_local(event.pos)
-                if event.button == 1:  # left mouse button
+                if event.button == 1 and not is_computers_turn():  # left mouse button
                     grid.mouse_press(pos)
 
 
 def process_game():
-    pass
+    """Ход компьютера: сначала ищется в дебютной книге, иначе поиск запускается в фоне,
+    а найденный ход делается, когда поиск закончится
+    """
+    global search
+    if search is None:
+        if is_computers_turn():
+            move = book.choose_move(grid.position) if book is not None else None
+            if move is not None:
+                piece, x, y, promotion = move
+                grid.position.move_piece(piece, x, y, promotion)
+                return
+            search = BackgroundSearch(computer, grid.position)
+            search.start()
+    elif search.is_done():
+        key = search.best_move_key()
+        search = None
+        move = find_move(grid.position, key) if key is not None else None
+        if move is not None:
+            piece, x, y, promotion = move
+            grid.position.move_piece(piece, x, y, promotion)
+
+
+def collect_dirty_rects():
+    """Собирает области окна, которые изменились с прошлой отрисовки: клетки и фигуры поля,
+    кнопки под курсором, смену набора кнопок и текст о ходе поиска
+    """
+    global drawn_buttons, drawn_thinking_text
+    rects = dirty_rects[:]
+    del dirty_rects[:]
+    rects.extend(grid.take_dirty_rects())
+
+    buttons = get_buttons()
+    if buttons != drawn_buttons:
+        for button in drawn_buttons + buttons:
+            rects.append(button.get_rect())
+        drawn_buttons = buttons
+    for button in buttons:
+        if button.dirty:
+            rects.append(button.get_rect())
+
+    thinking_text = search.describe() if search is not None else None
+    if thinking_text != drawn_thinking_text:
+        rects.append(pygame.Rect(THINKING_TEXT_RECT))
+        drawn_thinking_text = thinking_text
+
+    if profiler is not None and args.profile:
+        rects.append(pygame.Rect(profiler.get_overlay_rect(*PROFILER_OVERLAY_POS)))
+    return rects
 
 
 def render():
-    """ Отрисовка игры на экране
+    """ Отрисовка игры на экране. Рисуется только то, что изменилось: кадр ограничивается областью
+    измененных прямоугольников, и на экран выводятся только они
     """
+    rects = collect_dirty_rects()
+    if not rects:
+        return
+    clip_rect = rects[0].unionall(rects[1:])
+    screen.set_clip(clip_rect)
+
     main_screen = pygame.display.get_surface()
     main_screen.fill(WINDOW_BG_COLOR)  # Закрашиваем фон
 
     grid.render(screen)
-    for button in buttons:
+    for button in get_buttons():
         button.render(screen)
+    if search is not None:
+        font = screen.get_font('Arial', 18)
+        pix_x, pix_y, pix_w, pix_h = THINKING_TEXT_RECT
+        screen.draw_text(drawn_thinking_text, font, THINKING_TEXT_COLOR, pix_x, pix_y, pix_w, pix_h)
+    if profiler is not None and args.profile:
+        profiler.render(screen, *PROFILER_OVERLAY_POS)
+
+    screen.set_clip(None)
+    pygame.display.update(rects)  # Выводим на экран только измененные области
 
-    pygame.display.flip()  # Переключаем буфер
+# игровой цикл: кадр рисуется только после ввода или хода поиска, не чаще args.fps раз в секунду
+if profiler is not None:
+    handle_input = profiler.timed('handle_input', handle_input)
+    process_game = profiler.timed('process_game', process_game)
+    render = profiler.timed('render', render)
 
-# игровой цикл
+clock = pygame.time.Clock()
 while True:
-    handle_input()
+    handle_input(wait_for_events())
     process_game()
     render()
+    if profiler is not None:
+        profiler.end_frame()
+    clock.tick(args.fps)
@@ -0,0 +1,151 @@
+# encoding: utf-8
+"""Perft: подсчет числа позиций на заданной глубине для проверки генератора ходов и замера его скорости.
+
+Запуск:
+    python perft.py                       - все тестовые позиции, сверка с эталонными числами
+    python perft.py -p kiwipete -d 3      - одна позиция на заданную глубину
+    python perft.py -p start -d 3 --divide - число позиций отдельно для каждого первого хода
+    python perft.py --memory              - память на позицию и на проверку разрешенности хода
+"""
+
+from __future__ import division, print_function
+import argparse
+import time
+from position import Position, generate_legal_moves, move_name
+
+# Стандартные тестовые позиции: (расстановка в нотации FEN, ходят ли белые, эталонные числа для глубин 1, 2, ...).
+# Права на рокировку во всех позициях совпадают с тем, что короли и ладьи стоят на своих местах и еще не ходили
+PERFT_POSITIONS = {
+    'start': ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR', True,
+              [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R', True,
+                 [48, 2039, 97862, 4085603]),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8', True,
+                  [14, 191, 2812, 43238, 674624]),
+    'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1', True,
+                  [6, 264, 9467, 422333]),
+    'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R', True,
+                  [44, 1486, 62379, 2103487]),
+    'position6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1', True,
+                  [46, 2079, 89890, 3894594]),
+}
+
+
+def make_position(name):
+    """Создает позицию из таблицы тестовых позиций
+    name - название позиции
+    """
+    placement, is_whites_turn, _ = PERFT_POSITIONS[name]
+    position = Position(start_position=False)
+    position.place_pieces(placement, is_whites_turn)
+    return position
+
+
+def perft(position, depth):
+    """Возвращает число позиций, достижимых из данной ровно за depth полуходов
+    :type position: Position
+    """
+    moves = generate_legal_moves(position)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for piece, x, y, promotion in moves:
+        undo = position.make_move(piece, x, y, promotion)
+        nodes += perft(position, depth - 1)
+        position.unmake_move(undo)
+    return nodes
+
+
+def divide(position, depth):
+    """Возвращает список пар (ход, число позиций) для каждого первого хода
+    :type position: Position
+    """
+    result = []
+    for piece, x, y, promotion in generate_legal_moves(position):
+        name = move_name(piece.x, piece.y, x, y, promotion)
+        undo = position.make_move(piece, x, y, promotion)
+        result.append((name, perft(position, depth - 1)))
+        position.unmake_move(undo)
+    return result
+
+
+def memory_benchmark(names, count=200):
+    """Печатает, сколько байт занимает позиция (вместе с фигурами, таблицей атак и историей)
+    и сколько байт в пике выделяется на одну проверку разрешенности хода Position.try_move
+    names - имена тестовых позиций
+    count - сколько копий позиции строится для замера
+    """
+    import tracemalloc
+    tracemalloc.start()
+    for name in names:
+        before = tracemalloc.get_traced_memory()[0]
+        positions = [make_position(name) for _ in range(count)]
+        per_position = (tracemalloc.get_traced_memory()[0] - before) / count
+        position = positions[0]
+        del positions
+
+        moves = generate_legal_moves(position)
+        transient = 0
+        for piece, x, y, promotion in moves:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            position.try_move(piece, x, y)
+            transient += tracemalloc.get_traced_memory()[1] - current
+        print('%-10s %8.0f bytes/position %6.0f bytes/legality check (%d moves)' % (
+            name, per_position, transient / len(moves), len(moves)))
+    tracemalloc.stop()
+
+
+def run_position(name, depth, show_divide):
+    """Считает perft одной позиции, печатает результат и скорость.
+    Возвращает True, если число совпало с эталонным (или эталона для этой глубины нет)
+    """
+    position = make_position(name)
+    expected_counts = PERFT_POSITIONS[name][2]
+    start = time.time()
+    if show_divide:
+        counts = divide(position, depth)
+        for move, count in sorted(counts):
+            print('%s: %d' % (move, count))
+        nodes = sum(count for _, count in counts)
+    else:
+        nodes = perft(position, depth)
+    elapsed = time.time() - start
+    expected = expected_counts[depth - 1] if depth <= len(expected_counts) else None
+    if expected is None:
+        verdict = ''
+    elif nodes == expected:
+        verdict = 'OK'
+    else:
+        verdict = 'FAIL (expected %d)' % expected
+    print('%-10s depth %d: %10d nodes %8.2fs %10.0f nodes/s %s' % (
+        name, depth, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0, verdict))
+    return expected is None or nodes == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Perft move generator test and benchmark')
+    parser.add_argument('-p', '--position', choices=sorted(PERFT_POSITIONS),
+                        help='test position, all positions if omitted')
+    parser.add_argument('-d', '--depth', type=int, default=3, help='search depth in plies')
+    parser.add_argument('--divide', action='store_true', help='show node counts for every root move')
+    parser.add_argument('--memory', action='store_true', help='measure memory per position and per legality check')
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error('depth must be at least 1')
+
+    names = [args.position] if args.position else sorted(PERFT_POSITIONS)
+    if args.memory:
+        memory_benchmark(names)
+        return
+    ok = True
+    suite_start = time.time()
+    for name in names:
+        ok = run_position(name, args.depth, args.divide) and ok
+    if len(names) > 1:
+        print('total %.2fs' % (time.time() - suite_start))
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
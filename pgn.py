@@ -0,0 +1,279 @@
+# encoding: utf-8
+
+from __future__ import division
+import re
+from collections import OrderedDict
+from pieces import CHESS_GRID, TEXT, King, Queen, Rook, Bishop, Knight, Pawn
+from position import FILES, START_FEN, Position, generate_legal_moves
+
+# Обязательные теги PGN в порядке записи и их значения по умолчанию
+SEVEN_TAG_ROSTER = [
+    ('Event', '?'),
+    ('Site', '?'),
+    ('Date', '????.??.??'),
+    ('Round', '?'),
+    ('White', '?'),
+    ('Black', '?'),
+    ('Result', '*'),
+]
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+LINE_WIDTH = 79
+
+SAN_PIECE_TYPES = {
+    'K': King,
+    'Q': Queen,
+    'R': Rook,
+    'B': Bishop,
+    'N': Knight,
+}
+SAN_RE = re.compile(r'^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$')
+TAG_RE = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]\s*$')
+TOKEN_RE = re.compile(r'\{|;|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{};()$]+')
+
+
+def square_name(x, y):
+    """Имя клетки, например 'e4'
+    """
+    return '%s%d' % (FILES[x], CHESS_GRID - y)
+
+
+def move_to_san(position, move, legal_moves=None):
+    """Запись хода в стандартной алгебраической нотации (SAN), например 'Nbd7', 'exd6', 'e8=Q+', 'O-O'.
+    Ход должен быть разрешен в позиции; позиция после вызова не меняется
+    position - позиция до хода
+    move - кортеж (фигура, x, y, promotion) из generate_legal_moves
+    legal_moves - список разрешенных ходов позиции, если уже посчитан
+    """
+    piece, x, y, promotion = move
+    if isinstance(piece, King) and abs(x - piece.x) == 2:
+        san = 'O-O' if x > piece.x else 'O-O-O'
+    else:
+        is_capture = position.get_piece(x, y) is not None
+        if isinstance(piece, Pawn):
+            is_capture = is_capture or x != piece.x
+            san = FILES[piece.x] + 'x' if is_capture else ''
+        else:
+            if legal_moves is None:
+                legal_moves = generate_legal_moves(position)
+            # другие фигуры того же типа, которые могут пойти в ту же клетку
+            rivals = [other for other, other_x, other_y, other_promotion in legal_moves
+                      if other is not piece and type(other) is type(piece) and (other_x, other_y) == (x, y)]
+            san = TEXT[type(piece)]
+            if rivals:
+                if all(other.x != piece.x for other in rivals):
+                    san += FILES[piece.x]
+                elif all(other.y != piece.y for other in rivals):
+                    san += str(CHESS_GRID - piece.y)
+                else:
+                    san += square_name(piece.x, piece.y)
+            if is_capture:
+                san += 'x'
+        san += square_name(x, y)
+        if promotion is not None:
+            san += '=' + TEXT[promotion]
+
+    undo = position.make_move(piece, x, y, promotion)
+    if position.king_under_attack(position.is_whites_turn):
+        san += '#' if not generate_legal_moves(position) else '+'
+    position.unmake_move(undo)
+    return san
+
+
+def parse_san(position, san, legal_moves=None):
+    """Находит ход по записи в SAN. Возвращает кортеж (фигура, x, y, promotion).
+    Бросает ValueError, если такого хода нет или запись неоднозначна
+    position - позиция до хода
+    san - запись хода; знаки шаха, мата и оценки ('+', '#', '!', '?') не обязательны
+    legal_moves - список разрешенных ходов позиции, если уже посчитан
+    """
+    text = san.rstrip('+#!?')
+    if legal_moves is None:
+        legal_moves = generate_legal_moves(position)
+
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        direction = 1 if len(text) == 3 else -1
+        for move in legal_moves:
+            piece, x, y, promotion = move
+            if isinstance(piece, King) and x - piece.x == 2 * direction:
+                return move
+        raise ValueError('illegal move %r' % san)
+
+    match = SAN_RE.match(text)
+    if match is None:
+        raise ValueError('bad SAN move %r' % san)
+    letter, from_file, from_rank, target, promotion_letter = match.groups()
+    piece_type = SAN_PIECE_TYPES[letter] if letter else Pawn
+    x = FILES.index(target[0])
+    y = CHESS_GRID - int(target[1])
+    from_x = FILES.index(from_file) if from_file else None
+    from_y = CHESS_GRID - int(from_rank) if from_rank else None
+    promotion = SAN_PIECE_TYPES[promotion_letter] if promotion_letter else None
+    if piece_type is Pawn and promotion is None and y in (0, CHESS_GRID - 1):
+        # превращение без указания фигуры считаем превращением в ферзя
+        promotion = Queen
+
+    found = [move for move in legal_moves
+             if type(move[0]) is piece_type and move[1] == x and move[2] == y and move[3] is promotion and
+             (from_x is None or move[0].x == from_x) and (from_y is None or move[0].y == from_y)]
+    if not found:
+        raise ValueError('illegal move %r' % san)
+    if len(found) > 1:
+        raise ValueError('ambiguous move %r' % san)
+    return found[0]
+
+
+class PgnGame:
+    """Партия, прочитанная из PGN
+    headers - теги партии в порядке записи
+    moves - ходы в SAN
+    result - результат партии ('1-0', '0-1', '1/2-1/2' или '*')
+    """
+    def __init__(self):
+        self.headers = OrderedDict()
+        self.moves = []
+        self.result = '*'
+
+    def start_position(self):
+        """Начальная позиция партии: из тега FEN, если он есть, иначе стандартная
+        """
+        fen = self.headers.get('FEN')
+        if fen is not None:
+            return Position.from_fen(fen)
+        return Position()
+
+    def replay(self):
+        """Проигрывает ходы партии и возвращает конечную позицию.
+        Бросает ValueError на первом неразрешенном ходе
+        """
+        position = self.start_position()
+        for number, san in enumerate(self.moves):
+            try:
+                move = parse_san(position, san)
+            except ValueError as error:
+                raise ValueError('ply %d: %s' % (number + 1, error))
+            position.make_move(*move)
+        position.check_game_end()
+        return position
+
+
+def game_result(position):
+    """Результат партии по позиции: мат, пат, ничья по правилам (Position.get_draw_reason)
+    или '*', если игра не закончена
+    """
+    if generate_legal_moves(position):
+        return '1/2-1/2' if position.get_draw_reason() is not None else '*'
+    if position.king_under_attack(position.is_whites_turn):
+        return '0-1' if position.is_whites_turn else '1-0'
+    return '1/2-1/2'
+
+
+def write_game(out, position, headers=None):
+    """Записывает историю ходов позиции как партию в PGN
+    out - поток для записи текста
+    position - позиция, ходы которой записываются; история проигрывается от position.start_fen
+    headers - словарь дополнительных тегов, например {'White': 'Player'}; заменяет значения по умолчанию
+    """
+    replay = Position.from_fen(position.start_fen)
+    moves = []
+    for number in range(len(position.game_history)):
+        from_x, from_y, to_x, to_y, promotion = position.game_history.get_move(number)
+        move = (replay.get_piece(from_x, from_y), to_x, to_y, promotion)
+        moves.append((replay.is_whites_turn, replay.fullmove_number, move_to_san(replay, move)))
+        replay.make_move(*move)
+
+    tags = OrderedDict(SEVEN_TAG_ROSTER)
+    tags['Result'] = game_result(replay)
+    if headers:
+        tags.update(headers)
+    if position.start_fen != START_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = position.start_fen
+    for name, value in tags.items():
+        out.write('[%s "%s"]\n' % (name, value.replace('\\', '\\\\').replace('"', '\\"')))
+    out.write('\n')
+
+    tokens = []
+    for index, (is_white, fullmove_number, san) in enumerate(moves):
+        if is_white:
+            tokens.append('%d.' % fullmove_number)
+        elif index == 0:
+            tokens.append('%d...' % fullmove_number)
+        tokens.append(san)
+    tokens.append(tags['Result'])
+
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_WIDTH:
+            out.write(line + '\n')
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    out.write(line + '\n\n')
+
+
+def read_games(stream):
+    """Читает партии из PGN построчно, не загружая файл целиком; генератор объектов PgnGame.
+    Комментарии, варианты и оценки ($1 и т.п.) пропускаются
+    stream - поток текста или любой итератор по строкам
+    """
+    game = None
+    in_comment = False
+    variation_depth = 0
+    for line in stream:
+        line = line.strip()
+        if in_comment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            in_comment = False
+            line = line[end + 1:]
+        elif line.startswith('%'):
+            # строка-экранирование
+            continue
+
+        if line.startswith('[') and variation_depth == 0:
+            match = TAG_RE.match(line)
+            if match is not None:
+                if game is not None and (game.moves or game.result != '*'):
+                    yield game
+                    game = None
+                if game is None:
+                    game = PgnGame()
+                name, value = match.groups()
+                game.headers[name] = re.sub(r'\\(.)', r'\1', value)
+                continue
+
+        position = 0
+        while position < len(line):
+            match = TOKEN_RE.search(line, position)
+            if match is None:
+                break
+            token = match.group()
+            position = match.end()
+            if token == '{':
+                end = line.find('}', position)
+                if end < 0:
+                    in_comment = True
+                    break
+                position = end + 1
+            elif token == ';':
+                break
+            elif token == '(':
+                variation_depth += 1
+            elif token == ')':
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth or token[0] == '$' or token[0].isdigit() and token.endswith('.'):
+                continue
+            elif token in RESULTS:
+                if game is None:
+                    game = PgnGame()
+                game.result = token
+                yield game
+                game = None
+            else:
+                if game is None:
+                    game = PgnGame()
+                game.moves.append(token)
+
+    if game is not None and (game.moves or game.headers):
+        yield game
@@ -1,39 +1,101 @@
 # encoding: utf-8
 
 from __future__ import division
-
-from attack import CellInfo
+from array import array
 
 PIECE_SIZE = 48
+CHESS_GRID = 8
 
 diagonal_moves = [[-1, -1], [-1, 1], [1, -1], [1, 1]]
 knight_moves = [[2, 1], [1, 2], [-1, 2], [-2, 1], [-1, -2], [-2, -1], [1, -2], [2, -1]]
 hor_vert_moves = [[-1, 0], [1, 0], [0, -1], [0, 1]]
+king_moves = hor_vert_moves + diagonal_moves
+
 
+def _on_board(x, y):
+    return 0 <= x < CHESS_GRID and 0 <= y < CHESS_GRID
 
-_last_id = 0
 
+def _build_jump_table(moves):
+    """Для каждой клетки - индексы клеток доски, куда можно прыгнуть одним из ходов moves
+    """
+    table = []
+    for index in range(CHESS_GRID * CHESS_GRID):
+        x, y = index % CHESS_GRID, index // CHESS_GRID
+        table.append(array('B', [(y + dy) * CHESS_GRID + x + dx for dx, dy in moves if _on_board(x + dx, y + dy)]))
+    return table
 
-def _new_id():
-    global _last_id
-    _last_id += 1
-    return _last_id
+
+def _build_ray_table(dx, dy):
+    """Для каждой клетки - индексы клеток доски вдоль луча [dx, dy] от нее до края, по порядку
+    """
+    table = []
+    for index in range(CHESS_GRID * CHESS_GRID):
+        x, y = index % CHESS_GRID + dx, index // CHESS_GRID + dy
+        cells = array('B')
+        while _on_board(x, y):
+            cells.append(y * CHESS_GRID + x)
+            x += dx
+            y += dy
+        table.append(cells)
+    return table
+
+
+def _build_masks(table):
+    """Битовые маски клеток таблицы: бит i установлен, если клетка i есть в списке
+    """
+    return [sum(1 << cell for cell in cells) for cells in table]
+
+
+# Таблицы строятся один раз при импорте; клетки задаются индексами y * CHESS_GRID + x и всегда лежат на доске.
+# RAYS[d][клетка] - клетки вдоль направления king_moves[d]: первые 4 направления ладейные, остальные - слоновьи
+RAYS = [_build_ray_table(dx, dy) for dx, dy in king_moves]
+KNIGHT_JUMPS = _build_jump_table(knight_moves)
+KING_JUMPS = _build_jump_table(king_moves)
+# PAWN_ATTACKS[is_white][клетка] - клетки, которые бьет пешка этого цвета
+PAWN_ATTACKS = {
+    True: _build_jump_table([[-1, -1], [1, -1]]),
+    False: _build_jump_table([[-1, 1], [1, 1]]),
+}
+KNIGHT_MASKS = _build_masks(KNIGHT_JUMPS)
+KING_MASKS = _build_masks(KING_JUMPS)
+PAWN_ATTACK_MASKS = dict((is_white, _build_masks(table)) for is_white, table in PAWN_ATTACKS.items())
+# RAY_DIRECTION[откуда * 64 + куда] - номер луча в RAYS, на котором лежит клетка куда, либо -1
+RAY_DIRECTION = array('b', [-1] * (CHESS_GRID * CHESS_GRID) ** 2)
+for _direction, _table in enumerate(RAYS):
+    for _index, _cells in enumerate(_table):
+        for _cell in _cells:
+            RAY_DIRECTION[_index * CHESS_GRID * CHESS_GRID + _cell] = _direction
 
 
 class ChessPieceBase:
     """Шахматная фигура
     x, y - Ячейковые коорд-ты (0 .. 7)
     is_white - True если фигура белая иначе False
-    id - уникальный идентификатор
+    is_slider - True если фигура ходит лучами (ферзь, ладья, слон), и ее атакуемые клетки зависят
+        от занятости клеток на пути
     """
-    def __init__(self, x, y, is_white, piece_id=None):
+    # без __dict__ позиция занимает на 10-20% меньше памяти (perft.py --memory), не в разы;
+    # сравнение и хеш остаются по объекту, фигуры - ключи словарей
+    __slots__ = ('x', 'y', 'is_white')
+    is_slider = False
+
+    def __init__(self, x, y, is_white):
         self.x = x
         self.y = y
         self.is_white = is_white
-        self.id = piece_id if piece_id is not None else _new_id()
 
     def render_at(self, screen, pix_x, pix_y, pix_size):
-        """Рисует фигуру в указанной ячейке
+        """Рисует фигуру в указанной ячейке; картинка фигуры собирается один раз на размер ячейки
+        screen - Экран
+        pix_x, pix_y - коор-ты левого верхнего угла в пикселах
+        pix_size - Размер ячейки в пикселях
+        """
+        screen.draw_sprite((self.__class__, self.is_white), pix_x, pix_y, pix_size, pix_size,
+                           lambda sprite_screen: self.draw_at(sprite_screen, 0, 0, pix_size))
+
+    def draw_at(self, screen, pix_x, pix_y, pix_size):
+        """Рисует фигуру в указанной ячейке без кеширования
         screen - Экран
         pix_x, pix_y - коор-ты левого верхнего угла в пикселах
         pix_size - Размер ячейки в пикселях
@@ -45,51 +107,82 @@ class ChessPieceBase:
         font = screen.get_font('Arial', 46)
         screen.draw_text(TEXT[self.__class__], font, text_color, pix_x, pix_y, pix_size, pix_size)
 
-    def clone(self):
-        """Создает идентичную копию фигуры
-        """
-        return self.__class__(self.x, self.y, self.is_white, self.id)
-
     def get_cells_to_move(self, grid):
         return self.get_attacked_cells(grid)
-        # TODO сделать рокировки для короля
 
     def can_move(self, x, y, grid):
         """Возвращает True, если фигуру можно переместить в эту пустую ячейку
         x, y - Координата ячейки
         grid - Игровое поле
         """
-        return [x, y] in self.get_cells_to_move(grid)
+        return self.can_attack(x, y, grid)
 
     def can_attack(self, x, y, grid):
-        """Возвращает True, если фигура может атаковать данную ячейку
+        """Возвращает True, если фигура может атаковать данную ячейку; проверка по таблицам, без списка клеток
         х, у - Координата ячейки
         grid - Игровое поле
         """
-        return [x, y] in self.get_attacked_cells(grid)
+        return self.attacks_index(y * CHESS_GRID + x, grid.board)
 
-    def trace_directions(self, direction, grid, length=7):
-        """Идем вдоль направлений от фигуры и возвращаем все клетки до первой встреченной фигуры
-        direction - список направлений, пар [dx, dy]
-            dx, dy - Шаги по осям соответствующих направлений
-        grid - Игровое поле
-        length - количество шагов по каждому из направлений
+    def attacks_index(self, index, board):
+        """Возвращает True, если фигура атакует клетку с индексом index
+        board - массив клеток позиции
+        """
+        return index in self.get_attacked_indices(board)
+
+    def trace_directions(self, rays, board):
+        """Идем вдоль лучей от фигуры и возвращаем индексы всех клеток до первой встреченной фигуры включительно
+        rays - список таблиц лучей из RAYS
+        board - массив клеток позиции
         """
         result = []
-        for dx, dy in direction:
-            for cell in range(1, length + 1):
-                result.append([self.x + dx * cell, self.y + dy * cell])
-                if grid.get_piece(self.x + dx * cell, self.y + dy * cell):
+        start = self.y * CHESS_GRID + self.x
+        for ray in rays:
+            for index in ray[start]:
+                result.append(index)
+                if board[index] is not None:
                     break
         return result
 
+    def get_attacked_indices(self, board):
+        """Возвращает список индексов атакуемых клеток доски
+        board - массив клеток позиции
+        """
+
     def get_attacked_cells(self, grid):
-        """Возвращает список атакуемых клеток
+        """Возвращает список атакуемых клеток [x, y]; все они лежат на доске
         grid - Игровое поле
         """
+        return [[index % CHESS_GRID, index // CHESS_GRID] for index in self.get_attacked_indices(grid.board)]
+
+
+class SliderPiece(ChessPieceBase):
+    """Дальнобойная фигура: ходит лучами, которые останавливаются на первой фигуре
+    rays - номера лучей в RAYS, по которым ходит фигура
+    """
+    __slots__ = ()
+    is_slider = True
+    rays = ()
+
+    def get_attacked_indices(self, board):
+        return self.trace_directions([RAYS[direction] for direction in self.rays], board)
+
+    def attacks_index(self, index, board):
+        start = self.y * CHESS_GRID + self.x
+        direction = RAY_DIRECTION[start * CHESS_GRID * CHESS_GRID + index]
+        if direction not in self.rays:
+            return False
+        for cell in RAYS[direction][start]:
+            if cell == index:
+                return True
+            if board[cell] is not None:
+                return False
+        return False
 
 
 class King(ChessPieceBase):
+    __slots__ = ()
+
     def get_cells_to_move(self, grid):
         """
         :type grid: grid.Grid
@@ -119,45 +212,62 @@ class King(ChessPieceBase):
                         begin_x = self.x
                         end_x = rook_x
                     for x in range(begin_x, end_x):
-                        if CellInfo(x, starting_row, not piece.is_white) in grid.attack_grid.attacked_cells:
+                        if grid.attack_grid.is_attacked(x, starting_row, not piece.is_white):
                             castle_allowed = False
 
-                    if grid.game_history.is_piece_moved(self) or grid.game_history.is_piece_moved(piece):
+                    if not grid.has_castling_right(self.is_white, rook_x):
                         castle_allowed = False
 
                     if castle_allowed:
                         cells += [[castle_x, starting_row]]
         return cells
 
-    def get_attacked_cells(self, grid):
-        return self.trace_directions(hor_vert_moves + diagonal_moves, grid, 1)
+    def get_attacked_indices(self, board):
+        return list(KING_JUMPS[self.y * CHESS_GRID + self.x])
 
+    def attacks_index(self, index, board):
+        return KING_MASKS[self.y * CHESS_GRID + self.x] >> index & 1 == 1
 
-class Queen(ChessPieceBase):
-    def get_attacked_cells(self, grid):
-        return self.trace_directions(hor_vert_moves + diagonal_moves, grid)
+    def can_move(self, x, y, grid):
+        return self.can_attack(x, y, grid) or [x, y] in self.get_cells_to_move(grid)
 
 
-class Rook(ChessPieceBase):
-    def get_attacked_cells(self, grid):
-        return self.trace_directions(hor_vert_moves, grid)
+class Queen(SliderPiece):
+    __slots__ = ()
+    rays = (0, 1, 2, 3, 4, 5, 6, 7)
 
 
-class Bishop(ChessPieceBase):
-    def get_attacked_cells(self, grid):
-        return self.trace_directions(diagonal_moves, grid)
+class Rook(SliderPiece):
+    __slots__ = ()
+    rays = (0, 1, 2, 3)
+
+
+class Bishop(SliderPiece):
+    __slots__ = ()
+    rays = (4, 5, 6, 7)
 
 
 class Knight(ChessPieceBase):
-    def get_attacked_cells(self, grid):
-        return self.trace_directions(knight_moves, grid, 1)
+    __slots__ = ()
+
+    def get_attacked_indices(self, board):
+        return list(KNIGHT_JUMPS[self.y * CHESS_GRID + self.x])
+
+    def attacks_index(self, index, board):
+        return KNIGHT_MASKS[self.y * CHESS_GRID + self.x] >> index & 1 == 1
 
 
 class Pawn(ChessPieceBase):
-    def get_attacked_cells(self, grid):
-        # TODO сделать взятие на проходе
-        dy = -1 if self.is_white else 1
-        return [[self.x - 1, self.y + dy], [self.x + 1, self.y + dy]]
+    __slots__ = ()
+
+    def get_attacked_indices(self, board):
+        return list(PAWN_ATTACKS[self.is_white][self.y * CHESS_GRID + self.x])
+
+    def attacks_index(self, index, board):
+        return PAWN_ATTACK_MASKS[self.is_white][self.y * CHESS_GRID + self.x] >> index & 1 == 1
+
+    def can_move(self, x, y, grid):
+        return [x, y] in self.get_cells_to_move(grid)
 
     def get_cells_to_move(self, grid):
         dy = -1 if self.is_white else 1
@@ -165,6 +275,11 @@ class Pawn(ChessPieceBase):
         cells = [[self.x, self.y + dy]]
         if self.y == pawn_row and not grid.get_piece(self.x, self.y + dy):
             cells.append([self.x, self.y + 2 * dy])
+        if grid.en_passant is not None and grid.is_whites_turn == self.is_white:
+            # взятие на проходе: пешка идет в пустую клетку, через которую перепрыгнула вражеская пешка
+            ep_x, ep_y = grid.en_passant
+            if ep_y == self.y + dy and abs(ep_x - self.x) == 1:
+                cells.append([ep_x, ep_y])
         return cells
 
 
@@ -0,0 +1,817 @@
+# encoding: utf-8
+
+from __future__ import division
+from attack import SimpleAttackGrid
+from pieces import (CHESS_GRID, TEXT, King, Queen, Rook, Bishop, Knight, Pawn, king_moves, RAYS, KNIGHT_JUMPS,
+                    PAWN_ATTACKS)
+from history import GameHistory
+from zobrist import PIECE_KEYS, SIDE_KEY, CASTLING_KEYS, compute_zobrist_key, en_passant_key
+
+
+FEN_PIECE_TYPES = {
+    'k': King,
+    'q': Queen,
+    'r': Rook,
+    'b': Bishop,
+    'n': Knight,
+    'p': Pawn,
+}
+
+# Права на рокировку, биты маски Position.castling_rights
+WHITE_KING_SIDE = 1
+WHITE_QUEEN_SIDE = 2
+BLACK_KING_SIDE = 4
+BLACK_QUEEN_SIDE = 8
+
+# (бит права, белые ли, клетка короля, клетка ладьи), клетки заданы индексами y * CHESS_GRID + x
+CASTLING_SQUARES = [
+    (WHITE_KING_SIDE, True, 7 * CHESS_GRID + 4, 7 * CHESS_GRID + 7),
+    (WHITE_QUEEN_SIDE, True, 7 * CHESS_GRID + 4, 7 * CHESS_GRID + 0),
+    (BLACK_KING_SIDE, False, 4, 7),
+    (BLACK_QUEEN_SIDE, False, 4, 0),
+]
+
+# Буквы прав на рокировку в нотации FEN
+CASTLING_LETTERS = [
+    (WHITE_KING_SIDE, 'K'),
+    (WHITE_QUEEN_SIDE, 'Q'),
+    (BLACK_KING_SIDE, 'k'),
+    (BLACK_QUEEN_SIDE, 'q'),
+]
+
+FILES = 'abcdefgh'
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Для каждой клетки - маска прав, которые остаются после хода из этой клетки или в нее
+CASTLING_MASK = [15] * (CHESS_GRID * CHESS_GRID)
+for _right, _is_white, _king_index, _rook_index in CASTLING_SQUARES:
+    CASTLING_MASK[_king_index] &= ~_right
+    CASTLING_MASK[_rook_index] &= ~_right
+
+# Сигнатура материала - число фигур каждого вида, по MATERIAL_BITS бит на вид, без королей.
+# Слоны на белых и на черных полях считаются разными видами: слон не меняет цвет поля,
+# а одноцветные слоны не могут поставить мат
+MATERIAL_BITS = 4
+MATERIAL_DIGITS = {}
+for _is_white in (True, False):
+    for _kind in (Pawn, Knight, 'light bishop', 'dark bishop', Rook, Queen):
+        MATERIAL_DIGITS[_kind, _is_white] = len(MATERIAL_DIGITS)
+
+
+def _material_mask(kinds):
+    mask = 0
+    for kind in kinds:
+        for is_white in (True, False):
+            mask |= (1 << MATERIAL_BITS) - 1 << MATERIAL_BITS * MATERIAL_DIGITS[kind, is_white]
+    return mask
+
+
+# виды, с которыми мат всегда возможен
+MATING_MATERIAL_MASK = _material_mask([Pawn, Rook, Queen])
+KNIGHTS_MASK = _material_mask([Knight])
+LIGHT_BISHOPS_MASK = _material_mask(['light bishop'])
+DARK_BISHOPS_MASK = _material_mask(['dark bishop'])
+# сигнатуры с одной легкой фигурой на доске
+SINGLE_MINOR_MATERIALS = set(1 << MATERIAL_BITS * MATERIAL_DIGITS[kind, is_white]
+                             for kind in (Knight, 'light bishop', 'dark bishop') for is_white in (True, False))
+
+# Правило 50 ходов: столько полуходов без взятий и ходов пешками
+FIFTY_MOVE_PLIES = 100
+# Позиция, повторившаяся столько раз, - ничья
+REPETITION_LIMIT = 3
+
+# Причины ничьей, Position.draw_reason
+DRAW_REPETITION = 'repetition'
+DRAW_FIFTY_MOVES = 'fifty_moves'
+DRAW_INSUFFICIENT_MATERIAL = 'insufficient_material'
+
+
+def move_name(from_x, from_y, to_x, to_y, promotion=None):
+    """Запись хода в виде 'e2e4' или 'a7a8q'
+    """
+    name = '%s%d%s%d' % (FILES[from_x], CHESS_GRID - from_y, FILES[to_x], CHESS_GRID - to_y)
+    if promotion is not None:
+        name += TEXT[promotion].lower()
+    return name
+
+
+def material_key(piece_type, is_white, index):
+    """Вклад фигуры в сигнатуру материала; при ходе сигнатура меняется на разность вкладов
+    index - клетка фигуры y * CHESS_GRID + x, нужна для слонов
+    """
+    if piece_type is King:
+        return 0
+    kind = piece_type
+    if piece_type is Bishop:
+        kind = 'light bishop' if (index % CHESS_GRID + index // CHESS_GRID) % 2 == 0 else 'dark bishop'
+    return 1 << MATERIAL_BITS * MATERIAL_DIGITS[kind, is_white]
+
+
+def is_insufficient_material(material):
+    """Возвращает True, если мат невозможен ни одной стороне: кроме королей только один конь или слон,
+    либо только слоны на полях одного цвета
+    material - сигнатура материала
+    """
+    if material & MATING_MATERIAL_MASK:
+        return False
+    knights = material & KNIGHTS_MASK
+    light_bishops = material & LIGHT_BISHOPS_MASK
+    dark_bishops = material & DARK_BISHOPS_MASK
+    if not knights and (not light_bishops or not dark_bishops):
+        return True
+    return material in SINGLE_MINOR_MATERIALS
+
+
+def piece_letter(piece):
+    """Буква фигуры в нотации FEN: большая для белых, маленькая для черных
+    :type piece: pieces.ChessPieceBase
+    """
+    letter = TEXT[piece.__class__]
+    return letter if piece.is_white else letter.lower()
+
+
+class MoveUndo:
+    """Запись, по которой можно отменить ход
+    piece - фигура, которой ходили
+    from_x, from_y - ячейка, из которой ходила фигура
+    captured - взятая фигура, либо None
+    captured_index - место взятой фигуры в списке фигур
+    rook, rook_from_x - ладья, которую передвинула рокировка, и ее прежняя коор-та, либо None
+    promoted - фигура, в которую превратилась пешка, либо None
+    en_passant - клетка для взятия на проходе до хода
+    halfmove_clock - число полуходов без взятий и ходов пешками до хода
+    castling_rights - права на рокировку до хода
+    zobrist_key - хеш позиции до хода
+    material - сигнатура материала до хода
+    attack_changes - список пар (фигура, атакуемые ей клетки до хода) для фигур, чьи атаки изменил ход
+    """
+    # запись создается на каждый пробный ход, поэтому без __dict__
+    __slots__ = ('piece', 'from_x', 'from_y', 'captured', 'captured_index', 'rook', 'rook_from_x', 'promoted',
+                 'en_passant', 'halfmove_clock', 'castling_rights', 'zobrist_key', 'material',
+                 'attack_changes')
+
+    def __init__(self, piece, from_x, from_y, captured, captured_index, rook, rook_from_x, en_passant,
+                 halfmove_clock, castling_rights, zobrist_key, material):
+        self.piece = piece
+        self.from_x = from_x
+        self.from_y = from_y
+        self.captured = captured
+        self.captured_index = captured_index
+        self.rook = rook
+        self.rook_from_x = rook_from_x
+        self.promoted = None
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.castling_rights = castling_rights
+        self.zobrist_key = zobrist_key
+        self.material = material
+        self.attack_changes = []
+
+
+class Position:
+    """Шахматная позиция без графики: расстановка фигур, очередь хода, атакуемые поля и история ходов.
+    Не зависит от pygame, поэтому годится для проверки ходов без окна.
+    pieces - список фигур на доске
+    board - массив из CHESS_GRID * CHESS_GRID клеток по строкам, в каждой фигура или None;
+        всегда согласован со списком pieces и дает доступ к клетке за O(1)
+    is_whites_turn - True если сейчас ход белых
+    en_passant - клетка [x, y], через которую только что перепрыгнула пешка, либо None;
+        в нее можно взять на проходе
+    castling_rights - битовая маска прав на рокировку (WHITE_KING_SIDE и т.д.)
+    halfmove_clock - число полуходов с последнего взятия или хода пешкой
+    fullmove_number - номер хода, растет после каждого хода черных
+    start_fen - позиция, с которой начата история ходов, в нотации FEN
+    zobrist_key - 64-битный хеш Зобриста позиции, обновляется на каждом ходе
+    repetitions - хеш позиции -> сколько раз позиция встречалась с начала истории ходов, включая текущую
+    key_history - хеши позиций с начала истории ходов по порядку, последний - хеш текущей позиции
+    material - сигнатура материала (см. material_key), обновляется на взятиях и превращениях
+    kings - словарь цвет (True для белых) -> король этого цвета; клетка короля всегда известна без поиска
+    attack_grid - поля, которые атакованы фигурами
+    game_history - история ходов
+    is_checkmate, is_stalemate, is_draw - признаки окончания игры
+    draw_reason - причина ничьей (DRAW_REPETITION и т.д.), либо None
+    """
+    def __init__(self, start_position=True):
+        """
+        start_position - расставить ли фигуры в начальную позицию
+        """
+        self.pieces = []
+        self.board = [None] * (CHESS_GRID * CHESS_GRID)
+        self.is_whites_turn = True
+        self.en_passant = None
+        self.castling_rights = 0
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.start_fen = START_FEN
+        self.zobrist_key = 0
+        self.repetitions = {}
+        self.key_history = []
+        self.material = 0
+        self.kings = {}
+        self.attack_grid = SimpleAttackGrid()
+        self.game_history = GameHistory()
+        self.is_checkmate = False
+        self.is_stalemate = False
+        self.is_draw = False
+        self.draw_reason = None
+
+        if start_position:
+            self.place_start_position()
+
+    def place_start_position(self):
+        """Расставляет фигуры в начальную позицию
+        """
+        for x in range(CHESS_GRID):
+            self.place_mirrored(Pawn, x, 1)
+        self.place_mirrored(King, 4, 0)
+        self.place_mirrored(Queen, 3, 0)
+        for x, kind in enumerate([Rook, Knight, Bishop]):
+            self.place_mirrored(kind, x, 0)
+            self.place_mirrored(kind, CHESS_GRID - 1 - x, 0)
+
+        self.refresh_state()
+
+    def place_pieces(self, placement, is_whites_turn=True):
+        """Расставляет фигуры по строке расстановки в нотации FEN, например 'rnbqkbnr/pppppppp/8/...'.
+        Строки идут сверху вниз, начиная с черной стороны доски (y = 0); большие буквы - белые фигуры
+        placement - строка расстановки
+        is_whites_turn - True если ходят белые
+        """
+        self.is_whites_turn = is_whites_turn
+        self.add_pieces(placement)
+        self.refresh_state()
+        self.start_fen = self.to_fen()
+
+    def add_pieces(self, placement):
+        """Ставит на доску фигуры из строки расстановки в нотации FEN. Бросает ValueError, если строка неверна
+        placement - строка расстановки
+        """
+        rows = placement.split('/')
+        if len(rows) != CHESS_GRID:
+            raise ValueError('FEN placement must have %d rows: %r' % (CHESS_GRID, placement))
+        for y, row in enumerate(rows):
+            x = 0
+            for char in row:
+                if char.isdigit():
+                    x += int(char)
+                    continue
+                piece_type = FEN_PIECE_TYPES.get(char.lower())
+                if piece_type is None or x >= CHESS_GRID:
+                    raise ValueError('bad FEN placement row %r' % row)
+                if piece_type is Pawn and y in (0, CHESS_GRID - 1):
+                    raise ValueError('FEN placement has a pawn on a back rank: %r' % placement)
+                self.add_piece(piece_type(x, y, char.isupper()))
+                x += 1
+            if x != CHESS_GRID:
+                raise ValueError('bad FEN placement row %r' % row)
+        if len([piece for piece in self.pieces if isinstance(piece, King)]) != 2 or len(self.kings) != 2:
+            raise ValueError('FEN placement must have one king of each colour: %r' % placement)
+
+    @classmethod
+    def from_fen(cls, fen):
+        """Создает позицию из записи в нотации FEN. Бросает ValueError, если запись неверна
+        fen - строка вида 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1';
+            счетчики полуходов и номер хода можно не указывать
+        """
+        fields = fen.split()
+        if len(fields) < 4 or fields[1] not in ('w', 'b'):
+            raise ValueError('bad FEN: %r' % fen)
+        placement, side, castling, en_passant = fields[:4]
+        position = cls(start_position=False)
+        position.add_pieces(placement)
+        position.is_whites_turn = side == 'w'
+
+        castling_rights = 0
+        if castling != '-':
+            letters = [letter for right, letter in CASTLING_LETTERS]
+            if any(letter not in letters for letter in castling) or len(set(castling)) != len(castling):
+                raise ValueError('bad FEN castling rights: %r' % fen)
+            for right, letter in CASTLING_LETTERS:
+                if letter in castling:
+                    castling_rights |= right
+
+        if en_passant != '-':
+            # клетка взятия - за пешкой соперника, которая только что прыгнула на два поля, и пустая
+            if len(en_passant) != 2 or en_passant[0] not in FILES or \
+                    en_passant[1] != ('6' if position.is_whites_turn else '3'):
+                raise ValueError('bad FEN en passant square: %r' % fen)
+            ep_x, ep_y = FILES.index(en_passant[0]), CHESS_GRID - int(en_passant[1])
+            pawn = position.get_piece(ep_x, ep_y + 1 if position.is_whites_turn else ep_y - 1)
+            if not isinstance(pawn, Pawn) or pawn.is_white == position.is_whites_turn or \
+                    position.get_piece(ep_x, ep_y) is not None:
+                raise ValueError('bad FEN en passant square: %r' % fen)
+            position.en_passant = [ep_x, ep_y]
+
+        try:
+            position.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            position.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError('bad FEN move counters: %r' % fen)
+        if position.halfmove_clock < 0 or position.fullmove_number < 1:
+            raise ValueError('bad FEN move counters: %r' % fen)
+
+        position.refresh_state(castling_rights)
+        # король стороны, которая не ходит, под шахом - такой позиции не бывает, следующим ходом его бы взяли
+        if position.king_under_attack(not position.is_whites_turn):
+            raise ValueError('FEN side not to move is in check: %r' % fen)
+        position.start_fen = position.to_fen()
+        return position
+
+    def to_fen(self):
+        """Запись позиции в нотации FEN
+        """
+        rows = []
+        for y in range(CHESS_GRID):
+            row = ''
+            empty = 0
+            for x in range(CHESS_GRID):
+                piece = self.board[y * CHESS_GRID + x]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece_letter(piece)
+            if empty:
+                row += str(empty)
+            rows.append(row)
+
+        castling = ''.join(letter for right, letter in CASTLING_LETTERS if self.castling_rights & right) or '-'
+        if self.en_passant is not None:
+            ep_x, ep_y = self.en_passant
+            en_passant = '%s%d' % (FILES[ep_x], CHESS_GRID - ep_y)
+        else:
+            en_passant = '-'
+        return '%s %s %s %s %d %d' % ('/'.join(rows), 'w' if self.is_whites_turn else 'b', castling, en_passant,
+                                      self.halfmove_clock, self.fullmove_number)
+
+    def refresh_state(self, castling_rights=None):
+        """Пересчитывает с нуля все, что выводится из расстановки: атакуемые клетки, права на рокировку, хеш
+        и сигнатуру материала. Вызывается после расстановки фигур; счет повторений начинается заново
+        castling_rights - права на рокировку; если не заданы, рокировка разрешена всем королям и ладьям,
+            стоящим на своих местах. Права для королей и ладей не на своих местах отбрасываются
+        """
+        self.refresh_attack_cells()
+        # рокировка возможна, только если король и ладья стоят на своих местах
+        possible_rights = 0
+        for right, is_white, king_index, rook_index in CASTLING_SQUARES:
+            king = self.board[king_index]
+            rook = self.board[rook_index]
+            if isinstance(king, King) and isinstance(rook, Rook) and king.is_white == rook.is_white == is_white:
+                possible_rights |= right
+        if castling_rights is None:
+            castling_rights = possible_rights
+        self.castling_rights = castling_rights & possible_rights
+        self.zobrist_key = compute_zobrist_key(self)
+        self.repetitions = {self.zobrist_key: 1}
+        self.key_history = [self.zobrist_key]
+        self.material = 0
+        for piece in self.pieces:
+            self.material += material_key(piece.__class__, piece.is_white, piece.y * CHESS_GRID + piece.x)
+
+    def to_state(self):
+        """Компактное представление позиции, которое дешево передавать между процессами:
+        кортеж (строка из CHESS_GRID * CHESS_GRID букв фигур или '.', ходят ли белые, права на рокировку,
+        клетка взятия на проходе, счетчик полуходов, хеши позиций с последнего взятия или хода пешкой).
+        История ходов не сохраняется, но счет повторений и правило 50 ходов продолжаются. Более ранние позиции
+        повториться уже не могут, поэтому их хеши не передаются
+        """
+        cells = [piece_letter(piece) if piece is not None else '.' for piece in self.board]
+        en_passant = tuple(self.en_passant) if self.en_passant is not None else None
+        return (''.join(cells), self.is_whites_turn, self.castling_rights, en_passant, self.halfmove_clock,
+                tuple(self.key_history[-self.halfmove_clock - 1:]))
+
+    @classmethod
+    def from_state(cls, state):
+        """Создает позицию из представления, полученного to_state
+        """
+        cells, is_whites_turn, castling_rights, en_passant, halfmove_clock, key_history = state
+        position = cls(start_position=False)
+        for index, char in enumerate(cells):
+            if char != '.':
+                position.add_piece(FEN_PIECE_TYPES[char.lower()](index % CHESS_GRID, index // CHESS_GRID, char.isupper()))
+        position.is_whites_turn = is_whites_turn
+        position.en_passant = list(en_passant) if en_passant is not None else None
+        position.halfmove_clock = halfmove_clock
+        position.refresh_state(castling_rights)
+        position.key_history = list(key_history)
+        position.repetitions = {}
+        for key in key_history:
+            position.repetitions[key] = position.repetitions.get(key, 0) + 1
+        position.start_fen = position.to_fen()
+        return position
+
+    def has_castling_right(self, is_white, rook_x):
+        """Возвращает True, если король и ладья с вертикали rook_x еще не теряли права на рокировку
+        """
+        if is_white:
+            right = WHITE_QUEEN_SIDE if rook_x == 0 else WHITE_KING_SIDE
+        else:
+            right = BLACK_QUEEN_SIDE if rook_x == 0 else BLACK_KING_SIDE
+        return bool(self.castling_rights & right)
+
+    def place_mirrored(self, piece_type, black_x, black_y):
+        """Ставит черную фигуру в заданную ячейку, и зеркально ей ставит такую же белую фигуру.
+        Используется для расстановки фигур в начальной позиции.
+        piece_type - Тип фигуры (Ферзь, король и т.д)
+        black_x, black_y - Координаты ячейки для черной фигуры
+        """
+        self.add_piece(piece_type(black_x, black_y, False))
+        self.add_piece(piece_type(black_x, CHESS_GRID - 1 - black_y, True))
+
+    def add_piece(self, piece):
+        """Ставит фигуру на доску в ее клетку
+        :type piece: pieces.ChessPieceBase
+        """
+        self.pieces.append(piece)
+        self.board[piece.y * CHESS_GRID + piece.x] = piece
+        if isinstance(piece, King):
+            self.kings[piece.is_white] = piece
+
+    @staticmethod
+    def good_coords(x, y):
+        """Возвращает True, если коор-ты х, у принадлежат ячейкам
+        """
+        return 0 <= x < CHESS_GRID and 0 <= y < CHESS_GRID
+
+    def get_piece(self, x, y):
+        """Принимает ячейковые коор-ты. Возвращает фигуру, которая находися в этой коор-те, либо None если фигуры нет
+        x, y - ячейковые коор-ты
+        """
+        if 0 <= x < CHESS_GRID and 0 <= y < CHESS_GRID:
+            return self.board[y * CHESS_GRID + x]
+        return None
+
+    def move_piece(self, piece, x, y, promotion=None):
+        """Делает ход фигурой в ячейку, если он разрешен правилами.
+        Возвращает True, если ход сделан, иначе False
+        piece - фигура, которой ходим
+        x, y - ячейковые коор-ты
+        promotion - тип фигуры для превращения пешки, по умолчанию ферзь
+        """
+        if self.is_stalemate or self.is_checkmate or self.is_draw or piece.is_white != self.is_whites_turn:
+            return False
+        if not self.try_move(piece, x, y):
+            return False
+
+        # совершаем ход; пешка на последней горизонтали превращается в ферзя, если не выбрано другое
+        self.make_move(piece, x, y, promotion)
+        self.check_game_end()
+        return True
+
+    def try_move(self, piece, x, y):
+        """Проверяет разрешенность хода фигурой в ячейку.
+        Ход делается прямо на доске и сразу отменяется. Возвращает True, если так ходить можно
+        piece - фигура, которой ходим
+        x, y - ячейковые коор-ты
+        """
+        if not self.good_coords(x, y):
+            return False
+
+        target_piece = self.get_piece(x, y)
+        if target_piece:
+            # двигаем в клетку, занятую фигурой
+            if target_piece.is_white == piece.is_white or not piece.can_attack(x, y, self):
+                return False
+        elif not piece.can_move(x, y, self):
+            # эта фигура не может так пойти
+            return False
+
+        # ход не должен открывать короля под шах
+        undo = self.make_move(piece, x, y)
+        king_attacked = self.king_under_attack(piece.is_white)
+        self.unmake_move(undo)
+        return not king_attacked
+
+    def make_move(self, piece, x, y, promotion=None):
+        """Делает ход фигурой в ячейку, не проверяя его разрешенность.
+        Возвращает запись MoveUndo, по которой ход можно отменить
+        piece - фигура, которой ходим
+        x, y - ячейковые коор-ты
+        promotion - тип фигуры, в которую превращается пешка на последней горизонтали, по умолчанию ферзь
+        """
+        board = self.board
+        from_index = piece.y * CHESS_GRID + piece.x
+        to_index = y * CHESS_GRID + x
+        changed_cells = [from_index, to_index]
+        # хеш обновляется по ходу: xor убирает ключ из хеша, повторный xor добавляет
+        key = self.zobrist_key ^ SIDE_KEY ^ en_passant_key(self) ^ PIECE_KEYS[piece.__class__, piece.is_white][from_index]
+
+        captured = board[to_index]
+        if captured is None and isinstance(piece, Pawn) and x != piece.x:
+            # взятие на проходе: побитая пешка стоит рядом, а не в клетке хода
+            captured = board[piece.y * CHESS_GRID + x]
+            board[piece.y * CHESS_GRID + x] = None
+            changed_cells.append(piece.y * CHESS_GRID + x)
+        captured_index = None
+        material = self.material
+        if captured is not None:
+            captured_index = self.pieces.index(captured)
+            del self.pieces[captured_index]
+            captured_at = captured.y * CHESS_GRID + captured.x
+            key ^= PIECE_KEYS[captured.__class__, captured.is_white][captured_at]
+            material -= material_key(captured.__class__, captured.is_white, captured_at)
+
+        rook = None
+        rook_from_x = None
+        if isinstance(piece, King) and abs(piece.x - x) == 2:
+            # рокировка, надо двигать ладью
+            if piece.x > x:
+                # длинная рокировка
+                rook = self.get_piece(0, piece.y)
+                rook_from_x = rook.x
+                rook.x = x + 1
+            else:
+                # короткая рокировка
+                rook = self.get_piece(7, piece.y)
+                rook_from_x = rook.x
+                rook.x = x - 1
+            board[rook.y * CHESS_GRID + rook_from_x] = None
+            board[rook.y * CHESS_GRID + rook.x] = rook
+            changed_cells += [rook.y * CHESS_GRID + rook_from_x, rook.y * CHESS_GRID + rook.x]
+            rook_keys = PIECE_KEYS[Rook, rook.is_white]
+            key ^= rook_keys[rook.y * CHESS_GRID + rook_from_x] ^ rook_keys[rook.y * CHESS_GRID + rook.x]
+
+        undo = MoveUndo(piece, piece.x, piece.y, captured, captured_index, rook, rook_from_x, self.en_passant,
+                        self.halfmove_clock, self.castling_rights, self.zobrist_key, self.material)
+        if captured is not None or isinstance(piece, Pawn):
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if not piece.is_white:
+            self.fullmove_number += 1
+        castling_rights = self.castling_rights & CASTLING_MASK[from_index] & CASTLING_MASK[to_index]
+        key ^= CASTLING_KEYS[self.castling_rights] ^ CASTLING_KEYS[castling_rights]
+        self.castling_rights = castling_rights
+        self.en_passant = None
+        if isinstance(piece, Pawn) and abs(piece.y - y) == 2:
+            self.en_passant = [x, (piece.y + y) // 2]
+        board[from_index] = None
+        board[to_index] = piece
+        piece.x = x
+        piece.y = y
+        self.is_whites_turn = not self.is_whites_turn
+
+        moved_pieces = [piece]
+        if isinstance(piece, Pawn) and (y == 0 or y == CHESS_GRID - 1):
+            # превращение пешки
+            promoted = (promotion or Queen)(x, y, piece.is_white)
+            self.pieces[self.pieces.index(piece)] = promoted
+            board[to_index] = promoted
+            undo.promoted = promoted
+            undo.attack_changes.append((piece, self.attack_grid.set_piece_cells(piece, None)))
+            moved_pieces = [promoted]
+            material += material_key(promoted.__class__, piece.is_white, to_index) - \
+                material_key(Pawn, piece.is_white, to_index)
+        self.material = material
+        self.game_history.add_move(from_index, to_index, board[to_index].__class__ if undo.promoted else None)
+        key ^= PIECE_KEYS[board[to_index].__class__, piece.is_white][to_index]
+        key ^= en_passant_key(self)
+        self.zobrist_key = key
+        self.repetitions[key] = self.repetitions.get(key, 0) + 1
+        self.key_history.append(key)
+        if rook is not None:
+            moved_pieces.append(rook)
+        self.update_attack_cells(undo, changed_cells, moved_pieces)
+        return undo
+
+    def update_attack_cells(self, undo, changed_cells, moved_pieces):
+        """Обновляет атакуемые клетки после хода, пересчитывая только затронутые фигуры:
+        походившие фигуры и те дальнобойные фигуры, чьи лучи проходят через клетки, у которых поменялась занятость.
+        Прежние клетки запоминаются в undo.attack_changes
+        changed_cells - индексы клеток, у которых поменялась занятость
+        moved_pieces - фигуры, которые сменили клетку
+        """
+        attack_grid = self.attack_grid
+        changes = undo.attack_changes
+        if undo.captured is not None:
+            changes.append((undo.captured, attack_grid.set_piece_cells(undo.captured, None)))
+        # лучи считаются по прежним атакам: луч меняется только если меняется занятость клетки на нем
+        to_refresh = list(moved_pieces)
+        for other in self.pieces:
+            if other.is_slider and other not in moved_pieces and attack_grid.crosses(other, changed_cells):
+                to_refresh.append(other)
+        for other in to_refresh:
+            changes.append((other, attack_grid.set_piece_cells(other, other.get_attacked_indices(self.board))))
+
+    def unmake_move(self, undo):
+        """Отменяет ход, сделанный make_move
+        :type undo: MoveUndo
+        """
+        piece = undo.piece
+        board = self.board
+        self.is_whites_turn = not self.is_whites_turn
+        self.en_passant = undo.en_passant
+        self.halfmove_clock = undo.halfmove_clock
+        if not piece.is_white:
+            self.fullmove_number -= 1
+        self.castling_rights = undo.castling_rights
+        count = self.repetitions[self.zobrist_key] - 1
+        if count:
+            self.repetitions[self.zobrist_key] = count
+        else:
+            del self.repetitions[self.zobrist_key]
+        self.key_history.pop()
+        self.zobrist_key = undo.zobrist_key
+        self.material = undo.material
+        self.game_history.pop_move()
+        board[piece.y * CHESS_GRID + piece.x] = None
+        if undo.promoted is not None:
+            self.pieces[self.pieces.index(undo.promoted)] = piece
+        board[undo.from_y * CHESS_GRID + undo.from_x] = piece
+        piece.x = undo.from_x
+        piece.y = undo.from_y
+        rook = undo.rook
+        if rook is not None:
+            board[rook.y * CHESS_GRID + rook.x] = None
+            board[rook.y * CHESS_GRID + undo.rook_from_x] = rook
+            rook.x = undo.rook_from_x
+        captured = undo.captured
+        if captured is not None:
+            board[captured.y * CHESS_GRID + captured.x] = captured
+            self.pieces.insert(undo.captured_index, captured)
+        for changed_piece, cells in reversed(undo.attack_changes):
+            self.attack_grid.set_piece_cells(changed_piece, cells)
+
+    def check_game_end(self):
+        """Проверяет после хода, закончилась ли игра: мат, пат или ничья по правилам (см. get_draw_reason)
+        """
+        if self.is_stalemate or self.is_checkmate:
+            return
+        if not generate_legal_moves(self):
+            # никакой ход невозможен
+            if self.king_under_attack(self.is_whites_turn):
+                # король под шахом - мат
+                self.is_checkmate = True
+            else:
+                # король не под шахом - пат
+                self.is_stalemate = True
+            return
+        self.draw_reason = self.get_draw_reason()
+        self.is_draw = self.draw_reason is not None
+
+    def get_draw_reason(self, repetition_limit=REPETITION_LIMIT):
+        """Причина ничьей по правилам, либо None. Все проверки за O(1) по счетчикам, которые ведет make_move:
+        недостаток материала, правило 50 ходов, повторение позиции
+        repetition_limit - сколько раз должна встретиться позиция; поиску хватает и двух
+        """
+        if is_insufficient_material(self.material):
+            return DRAW_INSUFFICIENT_MATERIAL
+        if self.halfmove_clock >= FIFTY_MOVE_PLIES:
+            return DRAW_FIFTY_MOVES
+        if self.repetitions.get(self.zobrist_key, 0) >= repetition_limit:
+            return DRAW_REPETITION
+        return None
+
+    def refresh_attack_cells(self):
+        """Обновляет атакуемые клетки
+        """
+        self.attack_grid.reset_cells()
+        for piece in self.pieces:
+            self.attack_grid.set_piece_cells(piece, piece.get_attacked_indices(self.board))
+
+    def king_under_attack(self, is_white_king):
+        """Возвращает True если король белого или черного цвета атакован
+        is_white_king - рассматриваем белого или черного короля
+        """
+        king_figure = self.kings.get(is_white_king)
+        if king_figure is None:
+            return True
+        return self.attack_grid.is_attacked(king_figure.x, king_figure.y, not is_white_king)
+
+
+PROMOTION_TYPES = [Queen, Rook, Bishop, Knight]
+
+
+def generate_legal_moves(position):
+    """Возвращает список разрешенных ходов стороны, чей сейчас ход.
+    Ход - кортеж (фигура, x, y, promotion), где promotion - тип фигуры для превращения пешки либо None.
+    Шахующие и связанные фигуры находятся один раз на позицию, поэтому ходы не пробуются на доске;
+    make_move/unmake_move нужен только для редкого взятия на проходе
+    :type position: Position
+    """
+    is_white = position.is_whites_turn
+    moves = []
+    king = position.kings.get(is_white)
+    if king is None:
+        return moves
+    board = position.board
+    attack_grid = position.attack_grid
+    enemy_counts = attack_grid.black_counts if is_white else attack_grid.white_counts
+    checks, pins = find_checks_and_pins(position, king)
+
+    # ходы короля: нельзя вставать на атакованные клетки и отходить вдоль линии шаха
+    forbidden = set()
+    for checker, cells, direction in checks:
+        if direction is not None:
+            dx, dy = direction
+            behind_x, behind_y = king.x - dx, king.y - dy
+            if 0 <= behind_x < CHESS_GRID and 0 <= behind_y < CHESS_GRID:
+                forbidden.add(behind_y * CHESS_GRID + behind_x)
+    for index in attack_grid.piece_cells[king]:
+        target = board[index]
+        if target is not None and target.is_white == is_white:
+            continue
+        if enemy_counts[index] or index in forbidden:
+            continue
+        moves.append((king, index % CHESS_GRID, index // CHESS_GRID, None))
+    if not checks:
+        for x, y in king.get_cells_to_move(position):
+            if abs(x - king.x) == 2:
+                moves.append((king, x, y, None))
+    elif len(checks) > 1:
+        # от двойного шаха можно только уйти королем
+        return moves
+
+    # при шахе можно только взять шахующую фигуру или закрыться от нее
+    evasion = checks[0][1] if checks else None
+    for piece in position.pieces:
+        if piece.is_white != is_white or piece is king:
+            continue
+        pin = pins.get(piece)
+        if isinstance(piece, Pawn):
+            targets = []
+            for index in PAWN_ATTACKS[is_white][piece.y * CHESS_GRID + piece.x]:
+                target = board[index]
+                if target is not None and target.is_white != is_white:
+                    targets.append(index)
+            for x, y in piece.get_cells_to_move(position):
+                if 0 <= x < CHESS_GRID and 0 <= y < CHESS_GRID and board[y * CHESS_GRID + x] is None:
+                    if x != piece.x:
+                        # взятие на проходе может открыть короля по горизонтали, проверяем на доске
+                        if position.try_move(piece, x, y):
+                            moves.append((piece, x, y, None))
+                    else:
+                        targets.append(y * CHESS_GRID + x)
+            for index in targets:
+                if pin is not None and index not in pin:
+                    continue
+                if evasion is not None and index not in evasion:
+                    continue
+                x, y = index % CHESS_GRID, index // CHESS_GRID
+                if y == 0 or y == CHESS_GRID - 1:
+                    for promotion in PROMOTION_TYPES:
+                        moves.append((piece, x, y, promotion))
+                else:
+                    moves.append((piece, x, y, None))
+        else:
+            for index in attack_grid.piece_cells[piece]:
+                target = board[index]
+                if target is not None and target.is_white == is_white:
+                    continue
+                if pin is not None and index not in pin:
+                    continue
+                if evasion is not None and index not in evasion:
+                    continue
+                moves.append((piece, index % CHESS_GRID, index // CHESS_GRID, None))
+    return moves
+
+
+def find_checks_and_pins(position, king):
+    """Ищет фигуры, которые шахуют короля, и фигуры, связанные с королем.
+    Возвращает пару (checks, pins):
+    checks - список троек (шахующая фигура, индексы клеток, куда можно взять или закрыться,
+        направление [dx, dy] от короля к дальнобойной фигуре либо None)
+    pins - словарь связанная фигура -> индексы клеток линии связки, по которым ей можно ходить
+    :type position: Position
+    :type king: pieces.King
+    """
+    is_white = king.is_white
+    board = position.board
+    king_index = king.y * CHESS_GRID + king.x
+    checks = []
+    pins = {}
+    for direction, ray in enumerate(RAYS):
+        # первые 4 луча ладейные, остальные слоновьи
+        slider_types = (Rook, Queen) if direction < 4 else (Bishop, Queen)
+        cells = []
+        own_piece = None
+        for index in ray[king_index]:
+            cells.append(index)
+            piece = board[index]
+            if piece is not None:
+                if piece.is_white == is_white:
+                    if own_piece is not None:
+                        break
+                    own_piece = piece
+                else:
+                    if isinstance(piece, slider_types):
+                        if own_piece is None:
+                            checks.append((piece, set(cells), king_moves[direction]))
+                        else:
+                            pins[own_piece] = set(cells)
+                    break
+
+    for index in KNIGHT_JUMPS[king_index]:
+        piece = board[index]
+        if isinstance(piece, Knight) and piece.is_white != is_white:
+            checks.append((piece, {index}, None))
+
+    # вражеская пешка бьет короля с тех клеток, которые била бы пешка цвета короля, стоящая на его месте
+    for index in PAWN_ATTACKS[is_white][king_index]:
+        piece = board[index]
+        if isinstance(piece, Pawn) and piece.is_white != is_white:
+            checks.append((piece, {index}, None))
+    return checks, pins
@@ -0,0 +1,148 @@
+# encoding: utf-8
+"""Замер времени по кадрам: сколько занимает каждая фаза кадра и сколько раз зовутся горячие функции.
+Функции оборачиваются только при включенном замере, поэтому без него накладных расходов нет.
+"""
+
+from __future__ import division
+import csv
+import time
+from collections import OrderedDict, deque
+
+DEFAULT_WINDOW = 300  # по скольким последним кадрам считаются перцентили
+PERCENTILES = [50, 95, 99]
+OVERLAY_BG_COLOR = [0, 0, 0, 192]
+OVERLAY_TEXT_COLOR = [255, 255, 0]
+OVERLAY_LINE_HEIGHT = 16
+OVERLAY_WIDTH = 360
+
+
+def percentile(values, percent):
+    """Перцентиль списка чисел методом ближайшего ранга; 0 для пустого списка
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[int(round(percent / 100 * (len(ordered) - 1)))]
+
+
+class Profiler:
+    """Сборщик замеров по кадрам
+    window - по скольким последним кадрам хранятся замеры
+    times - имя фазы -> очередь времен в секундах за последние кадры; 'frame' - время всего кадра
+    counts - имя функции -> очередь числа вызовов за последние кадры
+    frame_times, frame_counts - накопленное за текущий кадр
+    frame_start - момент начала текущего кадра
+    """
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.times = OrderedDict([('frame', deque(maxlen=window))])
+        self.counts = OrderedDict()
+        self.frame_times = {}
+        self.frame_counts = {}
+        self.frame_start = time.time()
+
+    def timed(self, name, function):
+        """Возвращает обертку функции, которая добавляет время ее работы к фазе name
+        """
+        self.times.setdefault(name, deque(maxlen=self.window))
+        frame_times = self.frame_times
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                frame_times[name] = frame_times.get(name, 0) + time.time() - start
+        return wrapper
+
+    def counted(self, name, function):
+        """Возвращает обертку функции, которая считает ее вызовы под именем name
+        """
+        self.counts.setdefault(name, deque(maxlen=self.window))
+        frame_counts = self.frame_counts
+
+        def wrapper(*args, **kwargs):
+            frame_counts[name] = frame_counts.get(name, 0) + 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    def time_method(self, owner, attribute, name=None):
+        """Заменяет метод класса (или функцию модуля) оберткой, замеряющей время
+        owner - класс или модуль
+        attribute - имя метода
+        name - имя фазы, по умолчанию 'Класс.метод'
+        """
+        name = name or '%s.%s' % (owner.__name__, attribute)
+        setattr(owner, attribute, self.timed(name, getattr(owner, attribute)))
+
+    def count_method(self, owner, attribute, name=None):
+        """Заменяет метод класса (или функцию модуля) оберткой, считающей вызовы
+        owner - класс или модуль
+        attribute - имя метода
+        name - имя счетчика, по умолчанию 'Класс.метод'
+        """
+        name = name or '%s.%s' % (owner.__name__, attribute)
+        setattr(owner, attribute, self.counted(name, getattr(owner, attribute)))
+
+    def end_frame(self):
+        """Завершает кадр: переносит накопленное в очереди последних кадров
+        """
+        now = time.time()
+        self.times['frame'].append(now - self.frame_start)
+        self.frame_start = now
+        for name, values in self.times.items():
+            if name != 'frame':
+                values.append(self.frame_times.get(name, 0))
+        for name, values in self.counts.items():
+            values.append(self.frame_counts.get(name, 0))
+        self.frame_times.clear()
+        self.frame_counts.clear()
+
+    def get_stats(self):
+        """Сводка по последним кадрам: список строк (имя, вид 'ms' или 'calls', кадров, среднее,
+        перцентили из PERCENTILES..., максимум). Времена в миллисекундах, вызовы - на кадр
+        """
+        rows = []
+        for kind, series, scale in (('ms', self.times, 1000), ('calls', self.counts, 1)):
+            for name, values in series.items():
+                values = [value * scale for value in values]
+                mean = sum(values) / len(values) if values else 0
+                rows.append([name, kind, len(values), mean] + [percentile(values, percent) for percent in PERCENTILES] +
+                            [max(values) if values else 0])
+        return rows
+
+    def export_csv(self, path):
+        """Записывает сводку get_stats в файл CSV
+        """
+        with open(path, 'w') as out:
+            writer = csv.writer(out)
+            writer.writerow(['name', 'unit', 'frames', 'mean'] + ['p%d' % percent for percent in PERCENTILES] + ['max'])
+            for row in self.get_stats():
+                writer.writerow(row[:3] + ['%.3f' % value for value in row[3:]])
+
+    def get_overlay_rect(self, pix_x, pix_y):
+        """Область экрана, которую занимает наложение со сводкой
+        """
+        lines = 1 + len(self.times) + len(self.counts)
+        return pix_x, pix_y, OVERLAY_WIDTH, lines * OVERLAY_LINE_HEIGHT + 4
+
+    def render(self, screen, pix_x, pix_y):
+        """Рисует сводку поверх экрана: p50/p95/p99 времени фаз и числа вызовов на кадр
+        :type screen: screen.Screen
+        pix_x, pix_y - левый верхний угол наложения в пикселях
+        """
+        x, y, width, height = self.get_overlay_rect(pix_x, pix_y)
+        screen.draw_rect(OVERLAY_BG_COLOR, x, y, width, height)
+        font = screen.get_font('Arial', 14)
+        lines = ['%-26s %7s %7s %7s' % (('name',) + tuple('p%d' % percent for percent in PERCENTILES))]
+        for row in self.get_stats():
+            name, kind = row[0], row[1]
+            p50, p95, p99 = row[4:7]
+            if kind == 'ms':
+                lines.append('%-26s %6.2fms %6.2fms %6.2fms' % (name, p50, p95, p99))
+            else:
+                lines.append('%-26s %7d %7d %7d' % (name, p50, p95, p99))
+        for number, line in enumerate(lines):
+            # без кеша надписей: числа меняются каждый кадр
+            text_surface = font.render(line, False, OVERLAY_TEXT_COLOR)
+            screen.surface.blit(text_surface, (x + 4, y + 2 + number * OVERLAY_LINE_HEIGHT))
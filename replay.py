@@ -0,0 +1,141 @@
+# encoding: utf-8
+"""Проверка баз партий в PGN: каждая партия проигрывается по правилам position.Position,
+неразрешенные ходы отмечаются, по каждой партии пишется строка JSON с итогом.
+Партии читаются потоком и раздаются пачками процессам-работникам.
+"""
+
+from __future__ import division, print_function
+import argparse
+import io
+import json
+import multiprocessing
+import sys
+import time
+from pgn import read_games, parse_san
+from workers import chunked, map_chunks
+
+DEFAULT_CHUNK_SIZE = 64
+
+
+def replay_game(number, game):
+    """Проигрывает партию так же, как ходы мышью на доске: каждый ход проверяется Position.move_piece,
+    попадает в историю, после хода проверяется конец игры. Возвращает словарь с итогом партии;
+    draw_ply - полуход, после которого впервые наступила ничья по правилам, либо None.
+    Любая ошибка при разборе партии записывается в итог как valid: false
+    number - номер партии в файле, с нуля
+    game - pgn.PgnGame
+    """
+    verdict = {
+        'game': number,
+        'white': game.headers.get('White'),
+        'black': game.headers.get('Black'),
+        'result': game.result,
+        'valid': True,
+        'error': None,
+    }
+    try:
+        play_game(game, verdict)
+    except Exception as error:
+        # сбой на одной записи не должен останавливать проверку всего архива
+        verdict.update(valid=False, error='%s: %s' % (type(error).__name__, error), plies=None, fen=None,
+                       status=None, draw_ply=None)
+    return verdict
+
+
+def play_game(game, verdict):
+    """Проигрывает ходы партии и дописывает в verdict поля valid, error, status, fen, plies и draw_ply
+    game - pgn.PgnGame
+    verdict - словарь итога партии
+    """
+    try:
+        position = game.start_position()
+    except ValueError as error:
+        verdict.update(valid=False, error=str(error), plies=0, fen=None, status=None, draw_ply=None)
+        return
+
+    draw_ply = None
+    for san in game.moves:
+        try:
+            piece, x, y, promotion = parse_san(position, san)
+        except ValueError as error:
+            verdict.update(valid=False, error='ply %d: %s' % (len(position.game_history) + 1, error))
+            break
+        if position.is_draw:
+            # в партиях ничью по повторению и правилу 50 ходов надо заявить, игроки могли играть дальше;
+            # parse_san уже проверил, что ход разрешен
+            position.make_move(piece, x, y, promotion)
+            position.check_game_end()
+        elif not position.move_piece(piece, x, y, promotion):
+            verdict.update(valid=False, error='ply %d: move %r rejected' % (len(position.game_history) + 1, san))
+            break
+        if position.is_draw and draw_ply is None:
+            draw_ply = len(position.game_history)
+
+    position.check_game_end()
+    if position.is_checkmate:
+        status = 'checkmate'
+    elif position.is_stalemate:
+        status = 'stalemate'
+    elif position.is_draw:
+        status = position.draw_reason
+    else:
+        status = 'ongoing'
+    verdict['status'] = status
+    verdict['fen'] = position.to_fen()
+    verdict['plies'] = len(position.game_history)
+    verdict['draw_ply'] = draw_ply
+
+
+def replay_chunk(chunk):
+    """Задание для процесса-работника: проигрывает пачку партий, возвращает список итогов
+    chunk - список пар (номер партии, pgn.PgnGame)
+    """
+    return [replay_game(number, game) for number, game in chunk]
+
+
+def replay_games(games, out, workers, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Проигрывает партии и пишет итоги в out по строке JSON на партию, в порядке партий в файле.
+    Возвращает пару (число партий, число партий с неразрешенными ходами)
+    games - итератор по pgn.PgnGame
+    out - поток для записи текста
+    workers - число процессов; при 1 все делается в текущем процессе
+    """
+    total = 0
+    invalid = 0
+    for verdicts in map_chunks(replay_chunk, chunked(enumerate(games), chunk_size), workers):
+        for verdict in verdicts:
+            out.write(json.dumps(verdict, sort_keys=True) + '\n')
+            total += 1
+            if not verdict['valid']:
+                invalid += 1
+    return total, invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay PGN games and report illegal moves as JSON Lines')
+    parser.add_argument('pgn', help='PGN file, - for standard input')
+    parser.add_argument('-o', '--output', default='-', help='JSON Lines output file, - for standard output')
+    parser.add_argument('-w', '--workers', type=int, default=multiprocessing.cpu_count(), help='number of processes')
+    parser.add_argument('-c', '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='games per task')
+    args = parser.parse_args()
+
+    if args.pgn == '-':
+        stream = sys.stdin
+    else:
+        stream = io.open(args.pgn, encoding='utf-8', errors='replace')
+    out = sys.stdout if args.output == '-' else io.open(args.output, 'w', encoding='utf-8')
+
+    start = time.time()
+    try:
+        total, invalid = replay_games(read_games(stream), out, args.workers, max(args.chunk_size, 1))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.time() - start
+    print('%d games, %d with illegal moves, %.2fs, %.1f games/s' % (
+        total, invalid, elapsed, total / elapsed if elapsed else 0), file=sys.stderr)
+    raise SystemExit(0 if invalid == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
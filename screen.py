@@ -1,16 +1,73 @@
 # encoding: utf-8
 
 from __future__ import division
+from collections import OrderedDict
 import pygame
 
+SURFACE_CACHE_SIZE = 256  # сколько заранее закрашенных поверхностей и спрайтов хранит Screen
+TEXT_CACHE_SIZE = 512  # сколько отрисованных надписей хранит Screen
+
+
+class SurfaceCache:
+    """Кеш готовых поверхностей с вытеснением давно не использованных (LRU)
+    max_size - сколько поверхностей хранить
+    surfaces - поверхности по ключу, от давно использованных к недавним
+    hits, misses - сколько раз поверхность нашлась в кеше и сколько раз ее пришлось создавать
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, create):
+        """Возвращает поверхность по ключу; если ее нет, создает вызовом create() и запоминает
+        key - ключ, например (ширина, высота, цвет)
+        create - функция без аргументов, создающая поверхность
+        """
+        surface = self.surfaces.pop(key, None)
+        if surface is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            surface = create()
+            if len(self.surfaces) >= self.max_size:
+                # вытесняем самую давно использованную
+                self.surfaces.popitem(last=False)
+        self.surfaces[key] = surface
+        return surface
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def reset_stats(self):
+        """Обнуляет счетчики попаданий и промахов
+        """
+        self.hits = 0
+        self.misses = 0
+
 
 class Screen:
     """Экран, на котором можно рисовать
     surface - Объект класса pygame.Surface, на котором и происходит рисование
+    surface_cache - закрашенные поверхности для draw_rect и draw_polygon и спрайты для draw_sprite
+    text_cache - отрисованные надписи для draw_text
     """
-    def __init__(self, surface):
+    def __init__(self, surface, surface_cache_size=SURFACE_CACHE_SIZE, text_cache_size=TEXT_CACHE_SIZE):
         self.surface = surface
         self.fonts = {}
+        self.surface_cache = SurfaceCache(surface_cache_size)
+        self.text_cache = SurfaceCache(text_cache_size)
+
+    def sub_screen(self, surface):
+        """Экран для рисования на другой поверхности с общими шрифтами и кешами
+        surface - поверхность pygame.Surface
+        """
+        screen = Screen(surface, 0, 0)
+        screen.fonts = self.fonts
+        screen.surface_cache = self.surface_cache
+        screen.text_cache = self.text_cache
+        return screen
 
     def get_size(self):
         """Размер области, на которой мы рисуем
@@ -18,6 +75,12 @@ class Screen:
         width, height = self.surface.get_size()
         return width, height
 
+    def set_clip(self, rect):
+        """Ограничивает рисование областью экрана
+        rect - область pygame.Rect, либо None чтобы снять ограничение
+        """
+        self.surface.set_clip(rect)
+
     def get_font(self, font_face, font_size):
         """Возвращаем кешированный шрифт
         font_face - название шрифта
@@ -35,9 +98,13 @@ class Screen:
         pix_w - Ширина в пикселях
         pix_h - Высота в пикселях
         """
-        # noinspection PyArgumentList
-        rect_surface = pygame.Surface((pix_w, pix_h), flags=pygame.SRCALPHA)
-        rect_surface.fill(color)
+        def create():
+            # noinspection PyArgumentList
+            rect_surface = pygame.Surface((pix_w, pix_h), flags=pygame.SRCALPHA)
+            rect_surface.fill(color)
+            return rect_surface
+
+        rect_surface = self.surface_cache.get(('rect', pix_w, pix_h, tuple(color)), create)
         self.surface.blit(rect_surface, (pix_x, pix_y))
 
     def draw_polygon(self, color, points_list):
@@ -61,10 +128,15 @@ class Screen:
 
         surface_points = []
         for x, y in points_list:
-            surface_points.append([x - x_min, y - y_min])
+            surface_points.append((x - x_min, y - y_min))
 
-        poly_surface = pygame.Surface((width, height), flags=pygame.SRCALPHA)
-        pygame.draw.polygon(poly_surface, color, surface_points)
+        def create():
+            poly_surface = pygame.Surface((width, height), flags=pygame.SRCALPHA)
+            pygame.draw.polygon(poly_surface, color, surface_points)
+            return poly_surface
+
+        # одинаковые многоугольники в разных местах экрана используют одну поверхность
+        poly_surface = self.surface_cache.get(('polygon', tuple(surface_points), tuple(color)), create)
         self.surface.blit(poly_surface, (x_min, y_min))
 
     def draw_text(self, text, font, color, pix_x, pix_y, pix_w, pix_h):
@@ -76,11 +148,28 @@ class Screen:
         pix_w - Ширина прямоугольника в пикселях
         pix_h - Высота прямоугольника в пикселях
         """
-        text_surface = font.render(text, False, color)
+        text_surface = self.text_cache.get((text, font, tuple(color)), lambda: font.render(text, False, color))
         text_x = pix_x + pix_w // 2 - text_surface.get_width() // 2
         text_y = pix_y + pix_h // 2 - text_surface.get_height() // 2
         self.surface.blit(text_surface, (text_x, text_y))
 
+    def draw_sprite(self, key, pix_x, pix_y, pix_w, pix_h, draw):
+        """Рисуем спрайт - картинку, которая собирается один раз и дальше берется из кеша
+        key - ключ спрайта; вместе с размером определяет картинку
+        pix_x, pix_y - координаты левого верхнего угла в пикселях
+        pix_w - Ширина в пикселях
+        pix_h - Высота в пикселях
+        draw - функция, которая получает Screen размером со спрайт и рисует на нем картинку
+        """
+        def create():
+            # noinspection PyArgumentList
+            sprite = pygame.Surface((pix_w, pix_h), flags=pygame.SRCALPHA)
+            draw(self.sub_screen(sprite))
+            return sprite
+
+        sprite = self.surface_cache.get(('sprite', key, pix_w, pix_h), create)
+        self.surface.blit(sprite, (pix_x, pix_y))
+
     def draw_frame(self, color, pix_x, pix_y, pix_w, pix_h, thickness):
         """Рисуем прямоугольную рамку
         color - Цвет, список из 3-х чисел 0..255
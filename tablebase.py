@@ -0,0 +1,567 @@
+# encoding: utf-8
+"""Эндшпильные таблицы для окончаний из 3 и 4 фигур (считая королей): для каждой расстановки
+и очереди хода - выигрыш, ничья или проигрыш и число полуходов до мата при лучшей игре.
+
+Таблицы строятся заранее ретроградным анализом по тем же таблицам ходов из pieces.py, что и правила игры:
+сначала находятся маты, затем от позиций с известным результатом ходы отматываются назад.
+Взятия и превращения ведут в таблицы с другим набором фигур, они строятся раньше.
+Взятие на проходе и рокировка в таблицах не учитываются.
+
+Таблица - файл из одного байта на позицию, индекс считается по клеткам фигур, поэтому проба - O(1).
+Позиции без пешек приводятся к каноническому виду симметриями доски (белый король в треугольнике a1-d1-d4),
+с пешками - отражением по горизонтали (белый король на вертикалях a-d).
+
+Запуск:
+    python tablebase.py                  - построить все таблицы из 3 фигур
+    python tablebase.py KQvKR KRvKB     - построить заданные таблицы (и нужные им меньшие)
+"""
+
+from __future__ import division, print_function
+import argparse
+import itertools
+import mmap
+import os
+import time
+from collections import defaultdict
+from pieces import (CHESS_GRID, TEXT, RAYS, RAY_DIRECTION, KING_JUMPS, KNIGHT_JUMPS, PAWN_ATTACKS, KING_MASKS,
+                    KNIGHT_MASKS, PAWN_ATTACK_MASKS, King, Knight, Pawn)
+from position import FEN_PIECE_TYPES, PROMOTION_TYPES
+
+TABLEBASE_DIR = os.path.join('data', 'tablebases')
+MAX_TABLEBASE_PIECES = 4
+THREE_PIECE_TABLES = ['KQvK', 'KRvK', 'KBvK', 'KNvK', 'KPvK']
+
+# Байт таблицы: DRAW - ничья, 1..127 - выигрыш за 2 * v - 1 полуходов,
+# 128..254 - проигрыш за 2 * (v - 128) полуходов (128 - мат уже стоит), INVALID - невозможная позиция
+DRAW = 0
+LOSS_BASE = 128
+INVALID = 255
+MAX_PLIES = 252
+
+# порядок фигур в имени таблицы и в слотах одного цвета
+PIECE_LETTERS = 'KQRBNP'
+LETTER_VALUES = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+
+
+def encode_win(plies):
+    return (plies + 1) // 2
+
+
+def encode_loss(plies):
+    return LOSS_BASE + plies // 2
+
+
+def decode_value(value):
+    """Расшифровывает байт таблицы: ('win' | 'loss' | 'draw', число полуходов до мата), либо None для INVALID
+    """
+    if value == INVALID:
+        return None
+    if value == DRAW:
+        return 'draw', 0
+    if value < LOSS_BASE:
+        return 'win', 2 * value - 1
+    return 'loss', 2 * (value - LOSS_BASE)
+
+
+def _transform(index, flip_x, flip_y, swap):
+    x, y = index % CHESS_GRID, index // CHESS_GRID
+    if swap:
+        x, y = y, x
+    if flip_x:
+        x = CHESS_GRID - 1 - x
+    if flip_y:
+        y = CHESS_GRID - 1 - y
+    return y * CHESS_GRID + x
+
+
+# Симметрии доски: таблицы клетка -> клетка. Первые две годятся и для позиций с пешками
+TRANSFORMS = [[_transform(index, flip_x, flip_y, swap) for index in range(CHESS_GRID * CHESS_GRID)]
+              for swap, flip_y, flip_x in itertools.product((False, True), repeat=3)]
+PAWN_TRANSFORMS = TRANSFORMS[:2]
+FLIP_COLORS = [_transform(index, False, True, False) for index in range(CHESS_GRID * CHESS_GRID)]
+
+
+def _king_region(pawnless):
+    """Клетки, куда симметрии приводят белого короля: треугольник a1-d1-d4 без пешек, вертикали a-d с пешками.
+    Напомним, что y = 0 - восьмая горизонталь
+    """
+    region = []
+    for index in range(CHESS_GRID * CHESS_GRID):
+        x, rank = index % CHESS_GRID, CHESS_GRID - 1 - index // CHESS_GRID
+        if x < CHESS_GRID // 2 and (not pawnless or rank <= x):
+            region.append(index)
+    return region
+
+
+def split_signature(signature):
+    """'KQvKR' -> ('KQ', 'KR')
+    """
+    white, black = signature.split('v')
+    return white, black
+
+
+def material_signature(white_letters, black_letters):
+    """Имя таблицы по буквам фигур сторон, например ('QK', 'RK') -> 'KQvKR'
+    """
+    def side(letters):
+        return ''.join(sorted(letters, key=PIECE_LETTERS.index))
+    return side(white_letters) + 'v' + side(black_letters)
+
+
+def is_canonical(signature):
+    """Таблицы хранятся для сильнейшей стороны за белых; иначе позицию надо отразить с заменой цветов
+    """
+    white, black = split_signature(signature)
+    return (sum(LETTER_VALUES[letter] for letter in white), white) >= \
+        (sum(LETTER_VALUES[letter] for letter in black), black)
+
+
+def flipped_signature(signature):
+    white, black = split_signature(signature)
+    return black + 'v' + white
+
+
+class TableLayout:
+    """Раскладка таблицы: какие фигуры в каких слотах и как позиция переводится в индекс
+    signature - имя таблицы, например 'KQvKR'
+    types, colors - тип и цвет (True - белая) фигуры в каждом слоте; слот 0 - белый король
+    pawnless - нет ли пешек; от этого зависят симметрии
+    region - клетки, допустимые для белого короля, и region_index - клетка -> номер в region или -1
+    size - число позиций в таблице (обе очереди хода)
+    """
+    def __init__(self, signature):
+        self.signature = signature
+        white, black = split_signature(signature)
+        self.types = [FEN_PIECE_TYPES[letter.lower()] for letter in white + black]
+        self.colors = [True] * len(white) + [False] * len(black)
+        self.pawnless = 'P' not in signature
+        self.transforms = TRANSFORMS if self.pawnless else PAWN_TRANSFORMS
+        self.region = _king_region(self.pawnless)
+        self.region_index = [-1] * (CHESS_GRID * CHESS_GRID)
+        for number, index in enumerate(self.region):
+            self.region_index[index] = number
+        self.side_size = len(self.region) * (CHESS_GRID * CHESS_GRID) ** (len(self.types) - 1)
+        self.size = 2 * self.side_size
+
+    def canonical(self, squares):
+        """Приводит клетки фигур симметрией к каноническому виду: белый король в region,
+        из нескольких подходящих симметрий берется дающая наименьший набор клеток
+        """
+        best = None
+        region_index = self.region_index
+        for transform in self.transforms:
+            if region_index[transform[squares[0]]] >= 0:
+                candidate = [transform[square] for square in squares]
+                if best is None or candidate < best:
+                    best = candidate
+        return best
+
+    def index(self, squares, is_whites_turn):
+        """Индекс позиции в таблице; клетки должны быть каноническими
+        """
+        index = self.region_index[squares[0]]
+        for square in squares[1:]:
+            index = index * (CHESS_GRID * CHESS_GRID) + square
+        return index if is_whites_turn else index + self.side_size
+
+    def positions(self):
+        """Перебирает все наборы клеток (канонические и нет) вместе с индексом для белых; индекс для черных
+        больше на side_size
+        """
+        index = 0
+        for king_square in self.region:
+            for others in itertools.product(range(CHESS_GRID * CHESS_GRID), repeat=len(self.types) - 1):
+                yield index, [king_square] + list(others)
+                index += 1
+
+
+def is_attacked(types, colors, squares, occupied, target, by_white, skip=None):
+    """Атакована ли клетка фигурами цвета by_white; фигура в слоте skip не учитывается (ее только что взяли)
+    occupied - множество занятых клеток
+    """
+    for slot, piece_type in enumerate(types):
+        if colors[slot] != by_white or slot == skip:
+            continue
+        square = squares[slot]
+        if piece_type is King:
+            if KING_MASKS[square] >> target & 1:
+                return True
+        elif piece_type is Knight:
+            if KNIGHT_MASKS[square] >> target & 1:
+                return True
+        elif piece_type is Pawn:
+            if PAWN_ATTACK_MASKS[by_white][square] >> target & 1:
+                return True
+        else:
+            direction = RAY_DIRECTION[square * CHESS_GRID * CHESS_GRID + target]
+            if direction in piece_type.rays:
+                for cell in RAYS[direction][square]:
+                    if cell == target:
+                        return True
+                    if cell in occupied:
+                        break
+    return False
+
+
+def king_square(types, colors, squares, is_white):
+    for slot, piece_type in enumerate(types):
+        if piece_type is King and colors[slot] == is_white:
+            return squares[slot]
+
+
+def is_legal_position(types, colors, squares, is_whites_turn):
+    """Возможна ли позиция: фигуры на разных клетках, пешки не на крайних горизонталях,
+    король стороны, которая не ходит, не под шахом
+    """
+    occupied = set(squares)
+    if len(occupied) != len(squares):
+        return False
+    for slot, piece_type in enumerate(types):
+        if piece_type is Pawn and squares[slot] // CHESS_GRID in (0, CHESS_GRID - 1):
+            return False
+    target = king_square(types, colors, squares, not is_whites_turn)
+    return not is_attacked(types, colors, squares, occupied, target, is_whites_turn)
+
+
+def piece_targets(piece_type, square, occupied):
+    """Клетки, куда фигура (не пешка) может пойти или бить, без учета цвета фигур на них
+    occupied - занятые клетки; дальнобойная фигура останавливается на первой из них
+    """
+    if piece_type is King:
+        return KING_JUMPS[square]
+    if piece_type is Knight:
+        return KNIGHT_JUMPS[square]
+    cells = []
+    for direction in piece_type.rays:
+        for cell in RAYS[direction][square]:
+            cells.append(cell)
+            if cell in occupied:
+                break
+    return cells
+
+
+def generate_moves(types, colors, squares, is_whites_turn):
+    """Разрешенные ходы стороны is_whites_turn. Каждый ход - тройка (новые клетки, слот взятой фигуры или None,
+    тип превращения или None). Клетки взятой фигуры в новом списке остаются прежними
+    """
+    occupied = dict((square, slot) for slot, square in enumerate(squares))
+    moves = []
+    for slot, piece_type in enumerate(types):
+        if colors[slot] != is_whites_turn:
+            continue
+        square = squares[slot]
+        candidates = []
+        if piece_type is Pawn:
+            step = -CHESS_GRID if is_whites_turn else CHESS_GRID
+            ahead = square + step
+            if ahead not in occupied:
+                candidates.append(ahead)
+                start_row = CHESS_GRID - 2 if is_whites_turn else 1
+                if square // CHESS_GRID == start_row and ahead + step not in occupied:
+                    candidates.append(ahead + step)
+            for cell in PAWN_ATTACKS[is_whites_turn][square]:
+                if cell in occupied:
+                    candidates.append(cell)
+        else:
+            candidates = piece_targets(piece_type, square, occupied)
+
+        for target in candidates:
+            captured = occupied.get(target)
+            if captured is not None and (colors[captured] == is_whites_turn or types[captured] is King):
+                continue
+            new_squares = list(squares)
+            new_squares[slot] = target
+            new_occupied = set(new_squares[number] for number in range(len(new_squares)) if number != captured)
+            king = target if piece_type is King else king_square(types, colors, squares, is_whites_turn)
+            if is_attacked(types, colors, new_squares, new_occupied, king, not is_whites_turn, captured):
+                continue
+            if piece_type is Pawn and target // CHESS_GRID in (0, CHESS_GRID - 1):
+                for promotion in PROMOTION_TYPES:
+                    moves.append((new_squares, captured, (slot, promotion)))
+            else:
+                moves.append((new_squares, captured, None))
+    return moves
+
+
+def generate_unmoves(types, colors, squares, is_whites_turn):
+    """Позиции, из которых последним ходом без взятия и превращения получилась данная.
+    Ходила сторона, которая сейчас не ходит. Возвращает списки клеток
+    """
+    occupied = set(squares)
+    moved_white = not is_whites_turn
+    result = []
+    for slot, piece_type in enumerate(types):
+        if colors[slot] != moved_white:
+            continue
+        square = squares[slot]
+        if piece_type is Pawn:
+            step = CHESS_GRID if moved_white else -CHESS_GRID
+            behind = square + step
+            origins = []
+            if behind not in occupied and 0 < behind // CHESS_GRID < CHESS_GRID - 1:
+                origins.append(behind)
+                start_row = CHESS_GRID - 2 if moved_white else 1
+                if (behind + step) // CHESS_GRID == start_row and behind + step not in occupied:
+                    origins.append(behind + step)
+        else:
+            # ходы короля, коня и дальнобойных фигур обратимы
+            origins = [cell for cell in piece_targets(piece_type, square, occupied) if cell not in occupied]
+        for origin in origins:
+            previous = list(squares)
+            previous[slot] = origin
+            result.append(previous)
+    return result
+
+
+class Tablebase:
+    """Набор таблиц в папке; таблицы открываются через mmap при первой пробе
+    directory - папка с файлами таблиц '<имя>.tb'
+    tables - имя таблицы -> (TableLayout, данные) либо None, если файла нет
+    """
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}
+
+    def get_path(self, signature):
+        return os.path.join(self.directory, signature + '.tb')
+
+    def get_table(self, signature):
+        """Возвращает пару (TableLayout, байты таблицы) либо None, если таблицы нет
+        """
+        if signature not in self.tables:
+            path = self.get_path(signature)
+            table = None
+            if os.path.exists(path):
+                layout = TableLayout(signature)
+                with open(path, 'rb') as table_file:
+                    data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+                if len(data) != layout.size:
+                    raise ValueError('bad tablebase file %r' % path)
+                table = layout, data
+            self.tables[signature] = table
+        return self.tables[signature]
+
+    def probe_squares(self, types, colors, squares, is_whites_turn):
+        """Байт таблицы для позиции, заданной списками типов, цветов и клеток фигур, либо None, если таблицы нет.
+        Два короля без других фигур - ничья
+        """
+        if len(types) == 2:
+            return DRAW
+        signature = material_signature([TEXT[piece_type] for piece_type, is_white in zip(types, colors) if is_white],
+                                       [TEXT[piece_type] for piece_type, is_white in zip(types, colors)
+                                        if not is_white])
+        if not is_canonical(signature):
+            signature = flipped_signature(signature)
+            colors = [not is_white for is_white in colors]
+            squares = [FLIP_COLORS[square] for square in squares]
+            is_whites_turn = not is_whites_turn
+        table = self.get_table(signature)
+        if table is None:
+            return None
+        layout, data = table
+        # расставляем фигуры по слотам таблицы: белые, затем черные, в каждом цвете в порядке KQRBNP
+        order = sorted(range(len(types)),
+                       key=lambda slot: (not colors[slot], PIECE_LETTERS.index(TEXT[types[slot]])))
+        canonical = layout.canonical([squares[slot] for slot in order])
+        return data[layout.index(canonical, is_whites_turn)]
+
+    def probe(self, position):
+        """Результат позиции по таблицам для стороны, чей ход: ('win' | 'loss' | 'draw', полуходов до мата),
+        либо None, если фигур больше MAX_TABLEBASE_PIECES, таблицы нет или позиция вне таблиц
+        (есть права на рокировку или возможно взятие на проходе)
+        :type position: position.Position
+        """
+        pieces = position.pieces
+        if len(pieces) > MAX_TABLEBASE_PIECES or position.castling_rights:
+            return None
+        if position.en_passant is not None:
+            ep_x, ep_y = position.en_passant
+            # клетки, с которых пешка стороны, чья очередь, может бить на проходе
+            attackers = PAWN_ATTACKS[not position.is_whites_turn][ep_y * CHESS_GRID + ep_x]
+            if any(isinstance(piece, Pawn) and piece.is_white == position.is_whites_turn and
+                   piece.y * CHESS_GRID + piece.x in attackers for piece in pieces):
+                return None
+        value = self.probe_squares([piece.__class__ for piece in pieces], [piece.is_white for piece in pieces],
+                                   [piece.y * CHESS_GRID + piece.x for piece in pieces], position.is_whites_turn)
+        if value is None:
+            return None
+        return decode_value(value)
+
+    def generate(self, signature, log=print):
+        """Строит таблицу и нужные ей меньшие таблицы, если их еще нет, и записывает в папку
+        """
+        if not is_canonical(signature):
+            signature = flipped_signature(signature)
+        if self.get_table(signature) is not None:
+            return
+        for smaller in sub_signatures(signature):
+            self.generate(smaller, log)
+        start = time.time()
+        data = generate_table(TableLayout(signature), self)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(self.get_path(signature), 'wb') as out:
+            out.write(data)
+        self.tables.pop(signature, None)
+        log('%-8s %9d positions %7.1fs' % (signature, len(data), time.time() - start))
+
+
+def sub_signatures(signature):
+    """Таблицы, в которые ведут взятия и превращения из данной (кроме двух голых королей)
+    """
+    white, black = split_signature(signature)
+    result = set()
+    for side, other, is_white in ((white, black, True), (black, white, False)):
+        for position, letter in enumerate(side):
+            if letter == 'K':
+                continue
+            rest = side[:position] + side[position + 1:]
+            # взятие фигуры этой стороны
+            if len(rest) + len(other) > 2:
+                result.add(material_signature(rest, other) if is_white else material_signature(other, rest))
+            if letter == 'P':
+                for promotion in 'QRBN':
+                    promoted = rest + promotion
+                    result.add(material_signature(promoted, other) if is_white else
+                               material_signature(other, promoted))
+    canonical = set()
+    for smaller in result:
+        canonical.add(smaller if is_canonical(smaller) else flipped_signature(smaller))
+    canonical.discard(signature)
+    return sorted(canonical)
+
+
+def generate_table(layout, tablebase):
+    """Ретроградный анализ одной таблицы; меньшие таблицы должны быть уже построены.
+    Возвращает bytearray значений
+    """
+    types, colors = layout.types, layout.colors
+    size = layout.size
+    values = bytearray([INVALID]) * size
+    decided = bytearray(size)
+    # число ходов внутри таблицы, результат которых еще не выигрыш соперника
+    remaining = bytearray(size)
+    # лучшее, что дают взятия и превращения: ничья, и самый долгий проигрыш на случай, если все ходы проигрывают
+    draw_exit = bytearray(size)
+    win_exit = {}
+    loss_exit = {}
+    # buckets[n] - позиции, результат которых станет известен на n полуходах до мата
+    buckets = defaultdict(list)
+
+    for base_index, squares in layout.positions():
+        if layout.canonical(squares) != squares:
+            continue
+        for is_whites_turn in (True, False):
+            if not is_legal_position(types, colors, squares, is_whites_turn):
+                continue
+            index = base_index if is_whites_turn else base_index + layout.side_size
+            values[index] = DRAW
+            moves = generate_moves(types, colors, squares, is_whites_turn)
+            if not moves:
+                king = king_square(types, colors, squares, is_whites_turn)
+                if is_attacked(types, colors, squares, set(squares), king, not is_whites_turn):
+                    buckets[0].append(index)
+                continue
+            # ходы, симметричные друг другу, ведут в одну позицию таблицы и считаются один раз
+            internal = set()
+            best_win = None
+            worst_loss = None
+            for new_squares, captured, promotion in moves:
+                if captured is None and promotion is None:
+                    internal.add(layout.index(layout.canonical(new_squares), not is_whites_turn))
+                    continue
+                # ход ведет в другую таблицу
+                new_types = list(types)
+                if promotion is not None:
+                    new_types[promotion[0]] = promotion[1]
+                keep = [slot for slot in range(len(types)) if slot != captured]
+                value = tablebase.probe_squares([new_types[slot] for slot in keep], [colors[slot] for slot in keep],
+                                                [new_squares[slot] for slot in keep], not is_whites_turn)
+                if value is None:
+                    raise ValueError('tablebase for a smaller ending is missing')
+                result = decode_value(value)
+                if result[0] == 'draw':
+                    draw_exit[index] = 1
+                elif result[0] == 'loss':
+                    plies = result[1] + 1
+                    if best_win is None or plies < best_win:
+                        best_win = plies
+                else:
+                    plies = result[1] + 1
+                    if worst_loss is None or plies > worst_loss:
+                        worst_loss = plies
+            remaining[index] = len(internal)
+            if best_win is not None:
+                win_exit[index] = best_win
+                buckets[best_win].append(index)
+            if worst_loss is not None:
+                loss_exit[index] = worst_loss
+            if not internal and best_win is None and not draw_exit[index]:
+                buckets[worst_loss].append(index)
+
+    plies = 0
+    while plies <= MAX_PLIES and any(level >= plies for level in buckets):
+        for index in buckets.pop(plies, ()):
+            if decided[index]:
+                continue
+            decided[index] = 1
+            is_whites_turn = index < layout.side_size
+            base_index = index if is_whites_turn else index - layout.side_size
+            squares = decode_index(layout, base_index)
+            if plies % 2 == 0:
+                values[index] = encode_loss(plies)
+                # кто привел соперника к проигрышу, тот выигрывает на полуход дольше
+                for previous_index in predecessors(layout, squares, is_whites_turn):
+                    if values[previous_index] != INVALID and not decided[previous_index]:
+                        buckets[plies + 1].append(previous_index)
+            else:
+                values[index] = encode_win(plies)
+                # у соперника стало на один непроигранный ход меньше
+                for previous_index in predecessors(layout, squares, is_whites_turn):
+                    if values[previous_index] == INVALID or decided[previous_index]:
+                        continue
+                    remaining[previous_index] -= 1
+                    if remaining[previous_index] == 0 and not draw_exit[previous_index] and \
+                            previous_index not in win_exit:
+                        buckets[max(plies + 1, loss_exit.get(previous_index, 0))].append(previous_index)
+        plies += 1
+    return values
+
+
+def predecessors(layout, squares, is_whites_turn):
+    """Индексы различных позиций, из которых данная получилась ходом внутри таблицы
+    """
+    return set(layout.index(layout.canonical(previous), not is_whites_turn)
+               for previous in generate_unmoves(layout.types, layout.colors, squares, is_whites_turn))
+
+
+def decode_index(layout, base_index):
+    """Клетки фигур по индексу таблицы (без очереди хода)
+    """
+    squares = []
+    for _ in range(len(layout.types) - 1):
+        squares.append(base_index % (CHESS_GRID * CHESS_GRID))
+        base_index //= CHESS_GRID * CHESS_GRID
+    squares.append(layout.region[base_index])
+    squares.reverse()
+    return squares
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate endgame tablebases by retrograde analysis')
+    parser.add_argument('tables', nargs='*', default=THREE_PIECE_TABLES,
+                        help='endings to generate, for example KQvKR; all 3-piece endings by default')
+    parser.add_argument('-d', '--directory', default=TABLEBASE_DIR, help='tablebase directory')
+    args = parser.parse_args()
+
+    tablebase = Tablebase(args.directory)
+    for signature in args.tables:
+        white, black = split_signature(signature)
+        if len(white + black) > MAX_TABLEBASE_PIECES or white.count('K') != 1 or black.count('K') != 1 or \
+                any(letter not in PIECE_LETTERS for letter in white + black):
+            parser.error('bad ending %r' % signature)
+        tablebase.generate(material_signature(white, black))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# encoding: utf-8
+"""Раздача пакетной работы процессам: поток заданий режется на пачки, пачки отдаются пулу процессов,
+результаты возвращаются в порядке пачек. Общее для утилит, которые обрабатывают большие файлы (replay, diagram).
+"""
+
+from __future__ import division
+from concurrent.futures import ProcessPoolExecutor
+
+
+def chunked(items, chunk_size):
+    """Разбивает поток на списки по chunk_size элементов; последний список может быть короче
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_chunks(function, chunks, workers, args=(), initializer=None, initargs=()):
+    """Зовет function(пачка, *args) для каждой пачки и отдает результаты в порядке пачек.
+    Поток пачек читается по мере работы: в работе не больше двух пачек на процесс, чтобы не читать весь файл
+    в память
+    function - функция уровня модуля, чтобы ее можно было передать в другой процесс
+    workers - число процессов; при 1 все делается в текущем процессе
+    initializer, initargs - функция, которую каждый процесс зовет один раз перед заданиями, и ее аргументы
+    """
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for chunk in chunks:
+            yield function(chunk, *args)
+        return
+
+    pool = ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs)
+    pending = []
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(function, chunk, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+    finally:
+        pool.shutdown()
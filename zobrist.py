@@ -0,0 +1,71 @@
+# encoding: utf-8
+"""Ключи Зобриста: 64-битный хеш позиции, который обновляется за O(1) на каждом ходе.
+Хеш позиции - xor ключей всех фигур в их клетках, ключа очереди хода черных, ключа прав на рокировку
+и ключа вертикали для взятия на проходе.
+"""
+
+from __future__ import division
+import random
+from pieces import CHESS_GRID, King, Queen, Rook, Bishop, Knight, Pawn
+
+# Зерно фиксировано, чтобы хеши совпадали между запусками и процессами
+_random = random.Random(0x5eed)
+
+
+def _new_key():
+    return _random.getrandbits(64)
+
+
+# (тип фигуры, белая ли) -> ключи для каждой клетки доски
+PIECE_KEYS = {}
+for _piece_type in (King, Queen, Rook, Bishop, Knight, Pawn):
+    for _is_white in (True, False):
+        PIECE_KEYS[_piece_type, _is_white] = [_new_key() for _ in range(CHESS_GRID * CHESS_GRID)]
+
+# Входит в хеш, когда ходят черные
+SIDE_KEY = _new_key()
+
+# Ключ для каждой комбинации прав на рокировку (битовая маска из 4-х бит)
+CASTLING_KEYS = [_new_key() for _ in range(16)]
+
+# Ключ для вертикали, на которой возможно взятие на проходе
+EN_PASSANT_KEYS = [_new_key() for _ in range(CHESS_GRID)]
+
+
+def piece_key(piece, x, y):
+    """Ключ фигуры в клетке
+    :type piece: pieces.ChessPieceBase
+    """
+    return PIECE_KEYS[piece.__class__, piece.is_white][y * CHESS_GRID + x]
+
+
+def en_passant_key(position):
+    """Ключ взятия на проходе. Учитывается только если рядом с перепрыгнувшей пешкой стоит пешка,
+    которая может ее взять, иначе одинаковые позиции получали бы разные хеши
+    :type position: position.Position
+    """
+    if position.en_passant is None:
+        return 0
+    ep_x, ep_y = position.en_passant
+    is_white = position.is_whites_turn
+    pawn_y = ep_y + 1 if is_white else ep_y - 1
+    for pawn_x in (ep_x - 1, ep_x + 1):
+        if 0 <= pawn_x < CHESS_GRID:
+            piece = position.board[pawn_y * CHESS_GRID + pawn_x]
+            if isinstance(piece, Pawn) and piece.is_white == is_white:
+                return EN_PASSANT_KEYS[ep_x]
+    return 0
+
+
+def compute_zobrist_key(position):
+    """Считает хеш позиции с нуля; при ходах хеш обновляется в position.Position.make_move
+    :type position: position.Position
+    """
+    key = 0
+    for piece in position.pieces:
+        key ^= piece_key(piece, piece.x, piece.y)
+    if not position.is_whites_turn:
+        key ^= SIDE_KEY
+    key ^= CASTLING_KEYS[position.castling_rights]
+    key ^= en_passant_key(position)
+    return key